@@ -0,0 +1,129 @@
+# animation.py
+import time
+from typing import Callable, List, Union
+
+from drawing import DRAW_XOR, fill
+from layout import Layout, Tile
+
+class Effect:
+    # Calls action(effect) every `period` seconds, `count` times or until cancelled, then finish(effect)
+    def __init__(self, period: float, action: Callable[['Effect'], None], count: Union[None, int] = None,
+                 finish: Union[None, Callable[['Effect'], None]] = None):
+        if period <= 0:
+            raise ValueError(f'Period {period} must be positive')
+        if count is not None and count <= 0:
+            raise ValueError(f'Count {count} must be positive')
+        self.period = period
+        self.action = action
+        self.count = count
+        self.finish = finish
+        self.runs = 0
+        self.due : Union[None, float] = None      # Next run on the animator clock, None until added
+
+    def __repr__(self):
+        return f'Effect(period={self.period}, runs={self.runs}, count={self.count})'
+
+class Animator:
+    """
+    Runs timed effects on a fixed-rate tick. Everything an effect draws during one tick goes out as
+    one planned transfer through layout.batch(transport), however many effects were due.
+    """
+    def __init__(self, layout: Layout, transport: Callable[[bytes, bytes], bool], rate: float = 20.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 budget: Union[None, int] = None):
+        if not isinstance(layout, Layout):
+            raise TypeError(f'Expected Layout, got {type(layout)}')
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+        if rate <= 0:
+            raise ValueError(f'Rate {rate} must be positive')
+
+        self.layout = layout
+        self.transport = transport
+        self.interval = 1 / rate
+        self.budget = budget        # Per-tick byte budget, see layout.bus_budget - held back changes go out on later ticks
+        self.clock = clock
+        self.sleep = sleep
+        self.effects : List[Effect] = []
+        self.ticks = 0
+        self._running = False
+
+    def add(self, effect: Effect, delay: float = 0.0) -> Effect:
+        effect.due = self.clock() + delay
+        self.effects.append(effect)
+        return effect
+
+    def cancel(self, effect: Effect):
+        if effect in self.effects:
+            self.effects.remove(effect)
+            if effect.finish is not None:
+                with self.layout.batch(self.transport):
+                    effect.finish(effect)
+
+    def every(self, period: float, action: Callable[[], None], count: Union[None, int] = None) -> Effect:
+        # Periodic re-render
+        return self.add(Effect(period, lambda effect: action(), count))
+
+    def toggle(self, period: float, on: Callable[[], None], off: Callable[[], None], count: Union[None, int] = None) -> Effect:
+        # on(), off(), on(), ... - cancelling after an on() leaves the off() state
+        def finish(effect):
+            if effect.runs % 2:
+                off()
+        return self.add(Effect(period, lambda effect: (off if effect.runs % 2 else on)(), count, finish))
+
+    def blink(self, tile: Tile, period: float, x: int = 0, y: int = 0, width: Union[None, int] = None,
+              height: Union[None, int] = None, count: Union[None, int] = None) -> Effect:
+        # Inverts a region of a tile every period, restoring it when the effect ends
+        width = tile.width - x if width is None else width
+        height = tile.height * 8 - y if height is None else height
+        invert = lambda: fill(tile, x, y, width, height, DRAW_XOR)
+        return self.toggle(period, invert, invert, count)
+
+    def countdown(self, period: float, start: int, action: Callable[[int], None],
+                  done: Union[None, Callable[[], None]] = None) -> Effect:
+        # action(start), action(start - 1), ... action(0), then done()
+        if start < 0:
+            raise ValueError(f'Countdown start {start} must not be negative')
+        finish = (lambda effect: done()) if done is not None else None
+        return self.add(Effect(period, lambda effect: action(start - effect.runs), start + 1, finish))
+
+    def tick(self, now: Union[None, float] = None) -> int:
+        # Runs every due effect and sends the result as one transfer - returns the number of effects run
+        now = self.clock() if now is None else now
+        # Effects land on the nearest tick, so float drift in the tick times cannot push one a whole tick late
+        due = [effect for effect in self.effects if effect.due <= now + self.interval / 2]
+        if not due:
+            if self.layout.deferred:
+                self.layout.commit(self.transport, budget=self.budget)
+            return 0
+
+        with self.layout.batch(self.transport, self.budget):
+            for effect in due:
+                effect.action(effect)
+                effect.runs += 1
+                # Keep the phase, but do not replay periods missed while stalled
+                effect.due += effect.period
+                if effect.due <= now:
+                    effect.due = now + effect.period
+                if effect.count is not None and effect.runs >= effect.count:
+                    self.effects.remove(effect)
+                    if effect.finish is not None:
+                        effect.finish(effect)
+        self.ticks += 1
+        return len(due)
+
+    def run(self, duration: Union[None, float] = None):
+        # Fixed-rate loop - ticks land on multiples of the interval, late ticks are skipped rather than bunched
+        self._running = True
+        start = next_tick = self.clock()
+        while self._running and (duration is None or next_tick - start < duration):
+            self.tick(next_tick)
+            next_tick += self.interval
+            now = self.clock()
+            if next_tick < now:
+                next_tick += (now - next_tick) // self.interval * self.interval + self.interval
+            self.sleep(max(next_tick - self.clock(), 0))
+        self._running = False
+
+    def stop(self):
+        self._running = False
@@ -0,0 +1,95 @@
+# capture.py
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+# File layout - header, then back-to-back records, each followed by its payload
+#   header : magic (8s) | version (B)
+#   record : timestamp (d, seconds since epoch) | address (B, 7-bit) | control (B) | payload length (H)
+CAPTURE_MAGIC = b'SSD1306C'
+CAPTURE_VERSION = 1
+
+_HEADER = struct.Struct('<8sB')
+_RECORD = struct.Struct('<dBBH')
+
+class Transaction(NamedTuple):
+    timestamp: float
+    address: int
+    control: int
+    payload: bytes
+
+    @property
+    def stream(self) -> bytes:
+        # Transaction as sent after the slave address
+        return bytes([self.control]) + self.payload
+
+class CaptureWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file : BinaryIO = open(path, 'ab')
+        # Senders on several threads share one writer - a record and its payload go out together
+        self._lock = threading.Lock()
+        if self._file.tell() == 0:
+            self._file.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+
+    def write(self, address: int, control: int, payload: bytes = b'', timestamp: Optional[float] = None):
+        if not 0 <= address < 0x80:
+            raise ValueError(f'Address 0x{address:02X} out of range (0x00-0x7F)')
+        if len(payload) > 0xFFFF:
+            raise ValueError(f'Payload length {len(payload)} exceeds 65535 bytes')
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            # A send racing set_capture(None) is not recorded
+            if self._file.closed:
+                return
+            self._file.write(_RECORD.pack(timestamp, address, control, len(payload)) + bytes(payload))
+
+    def write_stream(self, address: int, stream: bytes, timestamp: Optional[float] = None):
+        # Transaction as sent after the slave address - control byte first
+        if not stream:
+            raise ValueError('Transaction is empty')
+        self.write(address, stream[0], stream[1:], timestamp)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class CaptureReader:
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[Transaction]:
+        with open(self.path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError(f'{self.path}: truncated header')
+            magic, version = _HEADER.unpack(header)
+            if magic != CAPTURE_MAGIC:
+                raise ValueError(f'{self.path}: not a capture file')
+            if version != CAPTURE_VERSION:
+                raise ValueError(f'{self.path}: unsupported capture version {version}')
+            while True:
+                record = f.read(_RECORD.size)
+                if not record:
+                    break
+                if len(record) < _RECORD.size:
+                    print(f'WARNING: {self.path}: truncated record ignored')
+                    break
+                timestamp, address, control, length = _RECORD.unpack(record)
+                payload = f.read(length)
+                if len(payload) < length:
+                    print(f'WARNING: {self.path}: truncated payload ignored')
+                    break
+                yield Transaction(timestamp, address, control, payload)
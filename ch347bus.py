@@ -1,12 +1,16 @@
 
 import struct
-from typing import Dict
+from typing import Dict, Optional
 
 import ch347api
 
+from capture import CaptureWriter
+from ssd1306 import encode_control_stream
+
 class I2CDevice:
     _INSTANCE : 'I2CDevice' = None
     _DEVICES : Dict[int, ch347api.I2CDevice] = {}
+    _CAPTURE : Optional[CaptureWriter] = None
 
     def __new__(cls):
         if cls._INSTANCE is None:
@@ -32,6 +36,19 @@ class I2CDevice:
         # print('[I2C] Scan done.')
         pass
 
+    def set_capture(self, capture: Optional[CaptureWriter]):
+        # Record every write transaction, None to stop - the capture being replaced is closed
+        previous, I2CDevice._CAPTURE = I2CDevice._CAPTURE, capture
+        if previous is not None and previous is not capture:
+            previous.close()
+
+    def _record(self, addr, stream, ok):
+        # Only transactions the bus accepted are recorded
+        capture = self._CAPTURE
+        if ok and capture is not None:
+            capture.write_stream(addr, stream)
+        return ok
+
     def write_byte_data(self, addr, cmd, val):
         # print(f'[I2C] write_byte_data: addr=0x{addr:02X}, cmd=0x{cmd:02X}, val=0x{val:02X}')
         if addr not in self._DEVICES:
@@ -41,7 +58,7 @@ class I2CDevice:
             cmd = struct.pack('B', cmd)
         if isinstance(val, int):
             val = struct.pack('B', val)
-        return self._DEVICES[addr].write(cmd, val)
+        return self._record(addr, bytes(cmd) + bytes(val), self._DEVICES[addr].write(cmd, val))
 
     def write_block_data(self, addr, cmd, vals):
         # print(f'[I2C] write_block_data: addr=0x{addr:02X}, cmd=0x{cmd:02X}, vals={vals}')
@@ -54,4 +71,13 @@ class I2CDevice:
             vals = struct.pack('B', vals)
         if isinstance(vals, list):
             vals = struct.pack('B' * len(vals), *vals)
-        return self._DEVICES[addr].write(cmd, vals)
+        if isinstance(vals, (bytearray, memoryview)):
+            vals = bytes(vals)
+        return self._record(addr, bytes(cmd) + bytes(vals), self._DEVICES[addr].write(cmd, vals))
+
+    def write_transaction(self, addr, commands=(), data=b''):
+        # print(f'[I2C] write_transaction: addr=0x{addr:02X}, commands={commands}, data={data}')
+        if addr not in self._DEVICES:
+            self._DEVICES[addr] = ch347api.I2CDevice(addr)
+        stream = encode_control_stream(commands, bytes(data))
+        return self._record(addr, stream, self._DEVICES[addr].write(stream[:1], stream[1:]))
@@ -0,0 +1,77 @@
+# compositing.py
+from typing import Callable, List, Sequence
+
+from drawing import DRAW_COPY, DRAW_MODES, DRAW_OR, DRAW_XOR, combine_rows
+from layout import Tile, Window
+
+LAYER_BACKGROUND = 0
+LAYER_CONTENT = 1
+LAYER_OVERLAY = 2
+
+class Compositor:
+    """
+    Stacks off-screen layers over a tile - draw into compositor.layers[i] with anything that draws on a tile.
+    composite() blends only the region whose layers changed, bottom to top, one row operation per page and layer,
+    and blits the result so the tile's own dirty tracking sends just the bytes that differ.
+    Layers of a tile in a Layout are composited by every commit.
+    """
+    def __init__(self, tile: Tile, modes: Sequence[int] = (DRAW_COPY, DRAW_OR, DRAW_XOR)):
+        if not isinstance(tile, Tile):
+            raise TypeError(f'Expected Tile, got {type(tile)}')
+        if not modes:
+            raise ValueError('At least one layer is required')
+        for mode in modes:
+            if mode not in DRAW_MODES:
+                raise ValueError(f'Invalid draw mode {mode}')
+
+        self.tile = tile
+        self.modes = list(modes)
+        # Standalone tiles - no layout, so drawing into them never sends anything
+        self.layers : List[Tile] = [Tile(tile.startpage, tile.startcolumn, tile.endpage, tile.endcolumn) for _ in modes]
+        self.composites = 0
+        if tile._layout is not None:
+            tile._layout._compositors.append(self)
+
+    def __getitem__(self, index: int) -> Tile:
+        return self.layers[index]
+
+    def set_mode(self, index: int, mode: int):
+        # OR draws, AND masks, CLEAR (AND-NOT) cuts out, XOR inverts what is below
+        if mode not in DRAW_MODES:
+            raise ValueError(f'Invalid draw mode {mode}')
+        if self.modes[index] != mode:
+            self.modes[index] = mode
+            layer = self.layers[index]
+            layer._mark_dirty(0, 0, layer.height - 1, layer.width - 1)
+
+    def composite(self) -> bool:
+        # Recomputes the union of the layers' dirty regions - True if anything was recomputed
+        with self.tile.lock:
+            span = None
+            for layer in self.layers:
+                with layer.lock:
+                    dirty, layer._dirty = layer._dirty, None
+                if dirty is None:
+                    continue
+                if span is None:
+                    span = dirty
+                else:
+                    span = [min(span[0], dirty[0]), min(span[1], dirty[1]), max(span[2], dirty[2]), max(span[3], dirty[3])]
+            if span is None:
+                return False
+
+            minpage, mincolumn, maxpage, maxcolumn = span
+            width = maxcolumn - mincolumn + 1
+            cover = [b'\xff' * width] * (maxpage - minpage + 1)
+            out = [bytes(width)] * (maxpage - minpage + 1)
+            for layer, mode in zip(self.layers, self.modes):
+                with layer.lock:
+                    rows = [bytes(layer._data[page][mincolumn:maxcolumn + 1]) for page in range(minpage, maxpage + 1)]
+                out = combine_rows(out, rows, cover, mode)
+            self.tile.blit(minpage, mincolumn, out)
+            self.composites += 1
+        return True
+
+    def flush(self, callback: Callable[[Window, memoryview], bool]) -> bool:
+        self.composite()
+        return self.tile.flush(callback)
@@ -0,0 +1,250 @@
+# display_daemon.py
+import os
+import selectors
+import socket
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+import fonts
+from layout import Layout, Printer
+from widgets import BarGraph, Gauge, Sparkline, Widget
+
+# One datagram per message, UTF-8 text, fields separated by single spaces - the text of a print is the rest of the line
+#   print <tile> <font> <y> <text>      text at pixel row y, e.g. 'print 2 font8x9 0 230.5 V'
+#   bar <tile> <value>                  level bar, value 0.0-1.0
+#   spark <tile> <value>                sparkline sample, value 0.0-1.0
+#   gauge <tile> <value>                gauge needle, value 0.0-1.0
+#   clear <tile>
+#   stats                               replies 'name=value ...' to the sender, if it has an address
+DEFAULT_SOCKET = '/tmp/ssd1306.sock'
+
+WIDGETS = {
+    'bar': (BarGraph, 'update'),
+    'spark': (Sparkline, 'push'),
+    'gauge': (Gauge, 'update'),
+}
+
+class DisplayDaemon:
+    """
+    Owns the layout, fonts and transport. Clients send compact messages, the daemon renders (with the Printer cache and
+    glyph diffing), keeps only the newest value per tile and sends everything due as one planned commit per frame.
+    """
+    def __init__(self, layout: Layout, transport: Callable[[bytes, bytes], bool], rate: float = 30.0,
+                 budget: Union[None, int] = None):
+        if not isinstance(layout, Layout):
+            raise TypeError(f'Expected Layout, got {type(layout)}')
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+        if rate <= 0:
+            raise ValueError(f'Rate {rate} must be positive')
+
+        self.layout = layout
+        self.transport = transport
+        self.interval = 1 / rate
+        self.budget = budget
+        self.printer = Printer(layout)
+        self._widgets : Dict[int, Widget] = {}
+        self._values : Dict[int, Tuple[str, List[float]]] = {}     # Widget values waiting for the next frame
+        self.stats = dict.fromkeys(('messages', 'errors', 'commits'), 0)
+
+    def _tile(self, field: str) -> int:
+        tile_index = int(field)
+        if tile_index < 0 or tile_index >= len(self.layout.tiles):
+            raise ValueError(f'Tile index {tile_index} out of range (0-{len(self.layout.tiles)-1})')
+        return tile_index
+
+    def handle(self, message: bytes) -> Union[None, bytes]:
+        # Applies one message - returns a reply, if the message asks for one
+        self.stats['messages'] += 1
+        command, _, rest = bytes(message).decode().rstrip('\n').partition(' ')
+        if command == 'print':
+            tile_index, font_name, y, text = rest.split(' ', 3)
+            font = getattr(fonts, font_name, None)
+            if not font_name.startswith('font') or not isinstance(font, dict):
+                raise ValueError(f'Unknown font {font_name}')
+            self.printer.submit(self._tile(tile_index), text, font, int(y))
+        elif command in WIDGETS:
+            tile_index, value = rest.split(' ')
+            tile_index, value = self._tile(tile_index), float(value)
+            kind, values = self._values.get(tile_index, (command, []))
+            # Bars and gauges only show the newest value, a sparkline keeps every sample
+            if kind != command or command != 'spark':
+                values = []
+            self._values[tile_index] = (command, values + [value])
+        elif command == 'clear':
+            tile_index = self._tile(rest)
+            self._widgets.pop(tile_index, None)
+            self._values.pop(tile_index, None)
+            # A print queued earlier in the frame would otherwise draw over the cleared tile
+            with self.printer._lock:
+                self.printer._pending.pop(tile_index, None)
+            tile = self.layout.tiles[tile_index]
+            with tile.lock:
+                self.printer._drawn.pop(tile_index, None)
+                tile.blit(0, 0, bytes(tile.width * tile.height), width=tile.width)
+        elif command == 'stats':
+            return ' '.join(f'{name}={value}' for name, value in {**self.stats, 'coalesced': self.printer.coalesced,
+                                                                   **self.printer.cache_info()}.items()).encode()
+        else:
+            raise ValueError(f'Unknown command {command!r}')
+        return None
+
+    def render(self) -> List[Exception]:
+        # Newest value per widget tile, then every pending print, then one commit - returns what failed
+        errors = []
+        while self._values:
+            tile_index, (kind, values) = self._values.popitem()
+            cls, method = WIDGETS[kind]
+            try:
+                widget = self._widgets.get(tile_index)
+                if not isinstance(widget, cls):
+                    widget = self._widgets[tile_index] = cls(self.layout.tiles[tile_index], minimum=0, maximum=1)
+                for value in values:
+                    getattr(widget, method)(value)
+            except Exception as e:
+                errors.append(e)
+        self.printer.render_pending()
+        errors += self.printer.failed.values()
+        # Failed frames stay pending and go out with the next one
+        try:
+            if self.layout.commit(self.transport, budget=self.budget):
+                self.stats['commits'] += 1
+            else:
+                errors.append(RuntimeError('Failed to commit layout'))
+        except Exception as e:
+            errors.append(e)
+        self.stats['errors'] += len(errors)
+        return errors
+
+    def serve(self, path: str = DEFAULT_SOCKET):
+        if os.path.exists(path):
+            # Only a stale socket is replaced - connecting succeeds while another daemon is bound to it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                os.unlink(path)
+            else:
+                raise RuntimeError(f'Another daemon is listening on {path}')
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        print(f'Listening on {path}...')
+
+        buffer = bytearray(4096)
+        view = memoryview(buffer)
+        next_frame = time.monotonic()
+        try:
+            while True:
+                # Sleep until a message or the next frame with held back changes, then drain the socket
+                timeout = max(next_frame - time.monotonic(), 0) if self.layout.deferred else None
+                if selector.select(timeout):
+                    errors = []
+                    while True:
+                        try:
+                            size, sender = sock.recvfrom_into(buffer)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        try:
+                            reply = self.handle(view[:size])
+                            if reply is not None and sender:
+                                sock.sendto(reply, sender)
+                        except Exception as e:
+                            self.stats['errors'] += 1
+                            errors.append(e)
+                else:
+                    errors = []
+                # Frame pacing - messages arriving before the next frame are coalesced into it
+                now = time.monotonic()
+                if now < next_frame:
+                    time.sleep(next_frame - now)
+                errors += self.render()
+                next_frame = max(next_frame + self.interval, time.monotonic())
+                if errors:
+                    print(f'Error: {errors[0]}' + (f' (+{len(errors) - 1} more)' if len(errors) > 1 else ''))
+        except KeyboardInterrupt:
+            print('Exiting...')
+        finally:
+            selector.close()
+            sock.close()
+            os.unlink(path)
+
+class DisplayClient:
+    def __init__(self, path: str = DEFAULT_SOCKET):
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, message: str):
+        self._sock.sendto(message.encode(), self.path)
+
+    def print(self, tile_index: int, text: str, font: str = 'font8x9', y: int = 0):
+        self.send(f'print {tile_index} {font} {y} {text}')
+
+    def bar(self, tile_index: int, value: float):
+        self.send(f'bar {tile_index} {value:g}')
+
+    def spark(self, tile_index: int, value: float):
+        self.send(f'spark {tile_index} {value:g}')
+
+    def gauge(self, tile_index: int, value: float):
+        self.send(f'gauge {tile_index} {value:g}')
+
+    def clear(self, tile_index: int):
+        self.send(f'clear {tile_index}')
+
+    def stats(self, timeout: float = 1.0) -> Union[None, Dict[str, int]]:
+        # Needs an address for the reply - Linux autobinds an abstract one
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.settimeout(timeout)
+        try:
+            sock.bind('')
+            sock.sendto(b'stats', self.path)
+            reply = sock.recv(4096)
+        except OSError:
+            return None
+        finally:
+            sock.close()
+        return {name: int(value) for name, value in (field.split('=') for field in reply.decode().split())}
+
+    def close(self):
+        self._sock.close()
+
+def parse_tiles(specs: List[str]) -> List[Tuple[int, int, int, int]]:
+    # 'STARTPAGE:STARTCOLUMN:ENDPAGE:ENDCOLUMN' per tile
+    return [tuple(int(value) for value in spec.split(':')) for spec in specs]
+
+if __name__ == '__main__':
+    import argparse
+
+    from lcd_display import PAGES, COLUMNS
+    from layout import bus_budget
+
+    parser = argparse.ArgumentParser(description='SSD1306 display daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Unix socket path (default {DEFAULT_SOCKET})')
+    parser.add_argument('--tile', action='append', metavar='P0:C0:P1:C1',
+                        help='Tile to host, in creation order (repeatable, default the whole panel)')
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=0x3C)
+    parser.add_argument('--port', type=int, default=12345, help='Emulator UDP port')
+    parser.add_argument('--ch347', action='store_true', help='Drive a real panel through the CH347 instead of the emulator')
+    parser.add_argument('--rate', type=float, default=30.0, help='Frames per second')
+    parser.add_argument('--frame-time', type=float, default=None, help='Bus time budget per frame in seconds')
+    args = parser.parse_args()
+
+    layout = Layout(PAGES, COLUMNS)
+    for tile in parse_tiles(args.tile or [f'0:0:{PAGES - 1}:{COLUMNS - 1}']):
+        layout.add_tile(*tile)
+
+    if args.ch347:
+        from ch347bus import I2CDevice
+        i2c = I2CDevice()
+        transport = lambda commands, data: i2c.write_transaction(args.address, commands, data)
+    else:
+        from lcd_update import send_transaction
+        transport = lambda commands, data: send_transaction(commands, data, args.address, args.port)
+
+    budget = bus_budget(args.frame_time) if args.frame_time else None
+    DisplayDaemon(layout, transport, args.rate, budget).serve(args.socket)
@@ -0,0 +1,159 @@
+# drawing.py
+from typing import List, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Combine modes - `src` is the shape or bitmap, `cover` the pixels it spans - src bits outside the cover are ignored
+DRAW_OR = 0         # dst | src
+DRAW_AND = 1        # dst & src inside the cover, untouched outside
+DRAW_XOR = 2        # dst ^ src
+DRAW_CLEAR = 3      # dst & ~src
+DRAW_COPY = 4       # src inside the cover, untouched outside
+
+DRAW_MODES = (DRAW_OR, DRAW_AND, DRAW_XOR, DRAW_CLEAR, DRAW_COPY)
+
+# Pixel coordinates are tile relative - x is the column, y the pixel row (page * 8 + bit, LSB on top)
+
+def _repeat(byte: int, width: int) -> int:
+    # Row of `width` identical bytes as one integer, for whole-row masking
+    return int.from_bytes(bytes([byte]) * width, 'big')
+
+def shift_rows(rows: Sequence, width: int, shift: int) -> List:
+    """
+    Moves page-major rows down by `shift` pixels (0-7).
+    Each page spills into the next, so the result has one row more than the input.
+    """
+    if not 0 <= shift < 8:
+        raise ValueError(f'Shift {shift} out of range (0-7)')
+    if not shift:
+        return list(rows)
+
+    if np is not None:
+        block = np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(len(rows), width)
+        out = np.zeros((len(rows) + 1, width), dtype=np.uint8)
+        out[:-1] |= block << shift
+        out[1:] |= block >> (8 - shift)
+        return list(out)
+
+    low = _repeat((0xFF << shift) & 0xFF, width)
+    high = _repeat(0xFF >> (8 - shift), width)
+    out = [0] * (len(rows) + 1)
+    for i, row in enumerate(rows):
+        value = int.from_bytes(row, 'big')
+        out[i] |= (value << shift) & low
+        out[i + 1] |= (value >> (8 - shift)) & high
+    return [value.to_bytes(width, 'big') for value in out]
+
+def combine_rows(dst: Sequence, src: Sequence, cover: Sequence, mode: int):
+    # One vectorised operation over the block, or one integer operation per page without NumPy
+    width = len(dst[0])
+    if np is not None:
+        d, s, c = (np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(len(rows), width) for rows in (dst, src, cover))
+        s = s & c
+        if mode == DRAW_OR:
+            return d | s
+        elif mode == DRAW_AND:
+            return d & (s | ~c)
+        elif mode == DRAW_XOR:
+            return d ^ s
+        elif mode == DRAW_CLEAR:
+            return d & ~s
+        return (d & ~c) | s
+
+    full = (1 << 8 * width) - 1
+    out = []
+    for d, s, c in zip(dst, src, cover):
+        d, s, c = int.from_bytes(d, 'big'), int.from_bytes(s, 'big'), int.from_bytes(c, 'big')
+        s &= c
+        if mode == DRAW_OR:
+            d |= s
+        elif mode == DRAW_AND:
+            d &= s | (full ^ c)
+        elif mode == DRAW_XOR:
+            d ^= s
+        elif mode == DRAW_CLEAR:
+            d &= full ^ s
+        else:
+            d = (d & (full ^ c)) | s
+        out.append(d.to_bytes(width, 'big'))
+    return out
+
+def _page_mask(low: int, high: int) -> int:
+    # Bits low..high-1 of a page byte
+    return ((1 << (high - low)) - 1) << low
+
+def _apply(tile, page: int, column: int, src: Sequence, cover: Sequence, width: int, mode: int):
+    # Clips a page-aligned block to the tile, combines it with what is there and blits the result
+    if mode not in DRAW_MODES:
+        raise ValueError(f'Invalid draw mode {mode}')
+    startpage, endpage = max(page, 0), min(page + len(src), tile.height)
+    startcolumn, endcolumn = max(column, 0), min(column + width, tile.width)
+    if startpage >= endpage or startcolumn >= endcolumn:
+        return
+
+    rows = slice(startpage - page, endpage - page)
+    columns = slice(startcolumn - column, endcolumn - column)
+    src = [row[columns] for row in src[rows]]
+    cover = [row[columns] for row in cover[rows]]
+    dst = [tile._data[i][startcolumn:endcolumn] for i in range(startpage, endpage)]
+    tile.blit(startpage, startcolumn, combine_rows(dst, src, cover, mode))
+
+def fill(tile, x: int, y: int, width: int, height: int, mode: int = DRAW_OR):
+    x0, x1 = max(x, 0), min(x + width, tile.width)
+    y0, y1 = max(y, 0), min(y + height, tile.height * 8)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    # A filled rectangle is the same mask byte across every column of a page
+    rows = []
+    for page in range(y0 // 8, (y1 - 1) // 8 + 1):
+        low, high = max(y0 - page * 8, 0), min(y1 - page * 8, 8)
+        rows.append(bytes([_page_mask(low, high)]) * (x1 - x0))
+    _apply(tile, y0 // 8, x0, rows, rows, x1 - x0, mode)
+
+def set_pixel(tile, x: int, y: int, mode: int = DRAW_OR):
+    fill(tile, x, y, 1, 1, mode)
+
+def hline(tile, x: int, y: int, length: int, mode: int = DRAW_OR):
+    fill(tile, x, y, length, 1, mode)
+
+def vline(tile, x: int, y: int, length: int, mode: int = DRAW_OR):
+    fill(tile, x, y, 1, length, mode)
+
+def rect(tile, x: int, y: int, width: int, height: int, mode: int = DRAW_OR):
+    # Outline only - the sides skip the corners so XOR does not cancel them
+    if width <= 0 or height <= 0:
+        return
+    hline(tile, x, y, width, mode)
+    if height > 1:
+        hline(tile, x, y + height - 1, width, mode)
+    if height > 2:
+        vline(tile, x, y + 1, height - 2, mode)
+        if width > 1:
+            vline(tile, x + width - 1, y + 1, height - 2, mode)
+
+def bitmap(tile, x: int, y: int, block, mode: int = DRAW_OR, width: Union[None, int] = None,
+           pixel_height: Union[None, int] = None):
+    """
+    Draws a page-major bitmap (anything Tile.blit accepts) with its top-left pixel at (x, y).
+    Bitmaps off a page boundary are shifted across two pages in one batched pass.
+    `pixel_height` limits the cover to the top rows of the bitmap, e.g. a 6 pixel font in an 8 pixel page.
+    """
+    height, width, flat = tile.block_rows(block, width)
+    if not height or not width:
+        return
+    if pixel_height is None:
+        pixel_height = height * 8
+    elif not 0 < pixel_height <= height * 8:
+        raise ValueError(f'Pixel height {pixel_height} out of range (1-{height * 8})')
+    rows = [flat[i * width:(i + 1) * width] for i in range(height)]
+    page, shift = divmod(y, 8)
+    if not shift and mode == DRAW_COPY and pixel_height == height * 8:
+        tile.blit(page, x, rows)
+        return
+    cover = [bytes([_page_mask(0, min(max(pixel_height - i * 8, 0), 8))]) * width for i in range(height)]
+    cover = shift_rows(cover, width, shift)
+    _apply(tile, page, x, shift_rows(rows, width, shift), cover, width, mode)
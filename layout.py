@@ -1,7 +1,29 @@
+import threading
+import time
+from collections import OrderedDict
 from collections.abc import Iterable
+from contextlib import contextmanager
 from typing import Callable, List, Dict, Tuple, Union
 
+from drawing import DRAW_COPY, bitmap
 from fonts import FontBase
+from ssd1306 import *
+
+# Bytes a new address window costs on the wire (Co-bit page and column commands plus the data control byte).
+# Unchanged runs shorter than this are re-sent rather than split into two windows.
+WINDOW_OVERHEAD = 13
+
+# Fixed cost of one transaction (start, address byte, stop, HID/UDP round trip) in byte equivalents
+TRANSACTION_COST = 32
+
+# Tile priorities for budgeted commits - urgent tiles go out every frame whatever the budget
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_URGENT = 2
+
+def bus_budget(seconds: float, clock_hz: int = 400_000) -> int:
+    # Byte budget for a frame time on an I2C bus - 9 clocks per byte with the ACK
+    return int(seconds * clock_hz / 9)
 
 class ByteArray(bytearray):
     def __init__(self, *args, **kwargs):
@@ -14,7 +36,8 @@ class ByteArray(bytearray):
     def __str__(self):
         return repr(self)
 
-class Tile:
+class Window:
+    # Rectangle of panel memory in absolute page/column coordinates - what a flush callback addresses
     def __init__(self, startpage, startcolumn, endpage, endcolumn):
         assert startpage <= endpage, f'Start page {startpage} must be less than or equal to end page {endpage}'
         assert startcolumn <= endcolumn, f'Start column {startcolumn} must be less than or equal to end column {endcolumn}'
@@ -22,8 +45,6 @@ class Tile:
         self.startcolumn = startcolumn
         self.endpage = endpage
         self.endcolumn = endcolumn
-        self._data : List[ByteArray] = [ByteArray([0] * self.width) for _ in range(self.height)]
-        self._dirty = False
 
     @property
     def width(self) -> int:
@@ -33,6 +54,29 @@ class Tile:
     def height(self) -> int:
         return self.endpage - self.startpage + 1
 
+    def overlaps(self, other: 'Window') -> bool:
+        if not isinstance(other, Window):
+            raise TypeError(f'Expected Window, got {type(other)}')
+
+        return not (self.endpage < other.startpage or self.startpage > other.endpage or
+                    self.endcolumn < other.startcolumn or self.startcolumn > other.endcolumn)
+
+    def __repr__(self):
+        return f'Window([{self.startpage}, {self.startcolumn}] --> [{self.endpage}, {self.endcolumn}])'
+
+class Tile(Window):
+    def __init__(self, startpage, startcolumn, endpage, endcolumn):
+        super().__init__(startpage, startcolumn, endpage, endcolumn)
+        # One contiguous page-major buffer (on-wire order for the tile window), rows are views into it
+        self._buffer = bytearray(self.width * self.height)
+        self._view = memoryview(self._buffer)
+        self._data : List[memoryview] = [self._view[i * self.width:(i + 1) * self.width] for i in range(self.height)]
+        self._dirty : Union[None, List[int]] = None    # Bounding box of changes - [minpage, mincolumn, maxpage, maxcolumn], tile relative
+        self._layout : Union[None, 'Layout'] = None     # Owning layout, flushes go through its shadow
+        self.priority = PRIORITY_NORMAL
+        # Held while drawing so the flusher never copies a half drawn tile - draw under it, flush outside it
+        self.lock = threading.RLock()
+
     def __getitem__(self, item : Union[int, Tuple[int, int]]) -> Union[int, bytes]:
         if isinstance(item, tuple):
             i, j = item
@@ -87,42 +131,135 @@ class Tile:
         else:
             value = bytes([value])
 
+        if self._data[i][j:j+len(value)] == value:
+            # Unchanged bytes do not widen the dirty span
+            return
         self._data[i][j:j+len(value)] = value
-        self._dirty = True
+        self._mark_dirty(i, j, i, j + len(value) - 1)
+
+    @staticmethod
+    def block_rows(block, width: Union[None, int] = None) -> Tuple[int, int, memoryview]:
+        # Normalises a page-major block to (height, width, flat bytes)
+        if hasattr(block, 'shape') and len(block.shape) == 2:
+            height, width = block.shape
+            return height, width, memoryview(block.tobytes())
+        elif isinstance(block, (bytes, bytearray, memoryview)):
+            if width is None or width <= 0:
+                raise ValueError('Width is required for a flat block')
+            flat = memoryview(block).cast('B')
+            if len(flat) % width:
+                raise ValueError(f'Block length {len(flat)} is not a multiple of width {width}')
+            return len(flat) // width, width, flat
+        elif isinstance(block, (list, tuple)):
+            if not block:
+                return 0, 0, memoryview(b'')
+            width = len(block[0])
+            if any(len(row) != width for row in block):
+                raise ValueError('Block rows must have the same length')
+            return len(block), width, memoryview(b''.join(bytes(row) for row in block))
+        else:
+            raise TypeError(f'Invalid block type: {type(block)}. Expected rows, bytes, memoryview or 2D array.')
+
+    def blit(self, page: int, column: int, block, clip: bool = True, width: Union[None, int] = None) -> bool:
+        """
+        Copies a page-major block into the tile with one slice assignment per row.
+        `block` is a list of rows, a 2D memoryview or NumPy uint8 array, or flat bytes with `width`.
+        Returns False if the block had to be clipped.
+        """
+        height, width, flat = self.block_rows(block, width)
+        if not height or not width:
+            return True
+
+        # Clip once against the tile
+        startpage, endpage = max(page, 0), min(page + height, self.height)
+        startcolumn, endcolumn = max(column, 0), min(column + width, self.width)
+        clipped = (startpage, endpage, startcolumn, endcolumn) != (page, page + height, column, column + width)
+        if clipped and not clip:
+            raise ValueError(f'Block {height}x{width} at [{page}, {column}] exceeds tile {self.height}x{self.width}')
+        if startpage >= endpage or startcolumn >= endcolumn:
+            return not clipped
+
+        for i in range(startpage, endpage):
+            offset = (i - page) * width + startcolumn - column
+            row = flat[offset:offset + endcolumn - startcolumn]
+            if self._data[i][startcolumn:endcolumn] == row:
+                continue
+            self._data[i][startcolumn:endcolumn] = row
+            self._mark_dirty(i, startcolumn, i, endcolumn - 1)
+        return not clipped
+
+    def _mark_dirty(self, minpage, mincolumn, maxpage, maxcolumn):
+        with self.lock:
+            if self._dirty is None:
+                self._dirty = [minpage, mincolumn, maxpage, maxcolumn]
+                if self._layout is not None:
+                    self._layout._enqueue(self)
+                return
+            dirty = self._dirty
+            dirty[0] = min(dirty[0], minpage)
+            dirty[1] = min(dirty[1], mincolumn)
+            dirty[2] = max(dirty[2], maxpage)
+            dirty[3] = max(dirty[3], maxcolumn)
+
+    def _snapshot(self) -> 'Tile':
+        # Copy of the buffer and dirty span taken atomically, leaving the tile clean - senders work from the copy
+        with self.lock:
+            copy = Tile(self.startpage, self.startcolumn, self.endpage, self.endcolumn)
+            copy._view[:] = self._buffer
+            copy._dirty, self._dirty = self._dirty, None
+            copy.priority = self.priority
+        return copy
 
     @property
     def dirty(self):
-        return self._dirty
+        return self._dirty is not None
 
-    def clear(self, callback: Callable[['Tile', List[int]], bool]):
-        self._data = [ByteArray([0] * self.width) for _ in range(self.height)]
-        self._dirty = True
+    @property
+    def dirty_window(self) -> Union[None, Window]:
+        if self._dirty is None:
+            return None
+        minpage, mincolumn, maxpage, maxcolumn = self._dirty
+        return Window(self.startpage + minpage, self.startcolumn + mincolumn,
+                      self.startpage + maxpage, self.startcolumn + maxcolumn)
+
+    def clear(self, callback: Callable[[Window, memoryview], bool]):
+        with self.lock:
+            self._view[:] = bytes(len(self._buffer))
+            self._mark_dirty(0, 0, self.height - 1, self.width - 1)
 
         return self.flush(callback)
 
-    def flush(self, callback: Callable[['Tile', List[int]], bool], force: bool = False) -> bool:
+    def _window_data(self, minpage, mincolumn, maxpage, maxcolumn) -> Union[memoryview, bytes]:
+        # Page-major bytes of a tile-relative span - zero-copy when it covers whole rows
+        if mincolumn == 0 and maxcolumn == self.width - 1:
+            return self._view[minpage * self.width:(maxpage + 1) * self.width]
+        return b''.join(self._data[page][mincolumn:maxcolumn + 1] for page in range(minpage, maxpage + 1))
+
+    def flush(self, callback: Callable[[Window, memoryview], bool], force: bool = False) -> bool:
+        if self._layout is not None:
+            return self._layout.flush_tile(self, callback, force)
+
         if not callable(callback):
             raise TypeError('Callback must be callable')
 
-        if not self._dirty:
+        if self._dirty is None:
             if not force:
                 print('Nothing to flush')
                 return True
 
-        if not callback(self, [self._data[i][j] for i in range(self.height) for j in range(self.width)]):
+        if force or self._dirty == [0, 0, self.height - 1, self.width - 1]:
+            window, span = self, (0, 0, self.height - 1, self.width - 1)
+        else:
+            window, span = self.dirty_window, self._dirty
+
+        # Zero-copy where possible - the data is only valid until the tile is written again
+        if not callback(window, self._window_data(*span)):
             return False
 
-        self._dirty = False
+        self._dirty = None
 
         return True
 
-    def overlaps(self, other: 'Tile') -> bool:
-        if not isinstance(other, Tile):
-            raise TypeError(f'Expected Tile, got {type(other)}')
-
-        return not (self.endpage < other.startpage or self.startpage > other.endpage or
-                    self.endcolumn < other.startcolumn or self.startcolumn > other.endcolumn)
-
     def __repr__(self):
         ret = f'Tile([{self.startpage}, {self.startcolumn}] --> [{self.endpage}, {self.endcolumn}])\n'
         ret += '>>> tile start'
@@ -140,13 +277,123 @@ class Tile:
         ret += '<<< tile end\n'
         return ret
 
+class Planner:
+    """
+    Chooses how to send a set of changed runs - page addressing runs, horizontal addressing windows,
+    or one bounding window up to a full frame - by a byte cost model of the Co-bit transactions.
+    """
+    def __init__(self, pages, columns, transaction_cost: int = TRANSACTION_COST):
+        self.pages = pages
+        self.columns = columns
+        self.transaction_cost = transaction_cost
+        self.mode : Union[None, int] = None     # Addressing mode the panel is in, None when unknown
+
+    def _window_commands(self, mode: int, window: Window) -> List[int]:
+        if mode == OPTION_ADDRESSING_MODE_PAGE:
+            return SSD1306_PA_MODE_SET_PAGE_ADDR.get_command(window.startpage) \
+                + SSD1306_PA_MODE_SET_COLUMN_ADDR_LOW.get_command(window.startcolumn & 0x0F) \
+                + SSD1306_PA_MODE_SET_COLUMN_ADDR_HIGH.get_command(window.startcolumn >> 4)
+        return SSD1306_HAVA_MODE_SET_PAGE_ADDR.get_command(window.startpage, window.endpage) \
+            + SSD1306_HAVA_MODE_SET_COLUMN_ADDR.get_command(window.startcolumn, window.endcolumn)
+
+    def commands(self, mode: int, window: Window) -> List[int]:
+        # Commands opening the window, switching addressing mode first when needed
+        commands = self._window_commands(mode, window)
+        if mode != self.mode:
+            commands = SSD1306_SET_MEMORY_ADDRESSING_MODE.get_command(mode) + commands
+            self.mode = mode
+        return commands
+
+    def cost(self, plan: List[Tuple[int, Window]]) -> int:
+        # Transaction overhead + Co-bit command pairs + data control byte + data
+        total = 0
+        mode = self.mode
+        for mode_, window in plan:
+            commands = len(self._window_commands(mode_, window)) + (2 if mode_ != mode else 0)
+            total += self.transaction_cost + 2 * commands + 1 + window.width * window.height
+            mode = mode_
+        return total
+
+    def _rect_cost(self, rect: List[int]) -> int:
+        return self.transaction_cost + 2 * 6 + 1 + (rect[2] - rect[0] + 1) * (rect[3] - rect[1] + 1)
+
+    def plan(self, runs: List[Tuple[int, int, int]],
+             spannable: Callable[[Window], bool] = lambda window: True) -> List[Tuple[int, Window]]:
+        """
+        Returns (addressing mode, window) pairs covering every (page, startcolumn, endcolumn) run.
+        `spannable` tells whether a window may cover bytes outside the runs.
+        """
+        if not runs:
+            return []
+
+        # Same-page runs closer than the cost of a new page window are merged
+        page_window = self.transaction_cost + 2 * 3 + 1
+        merged : List[List[int]] = []
+        for page, startcolumn, endcolumn in sorted(runs):
+            if merged and merged[-1][0] == page and startcolumn - merged[-1][2] - 1 < page_window \
+                    and spannable(Window(page, merged[-1][1], page, endcolumn)):
+                merged[-1][2] = max(merged[-1][2], endcolumn)
+            else:
+                merged.append([page, startcolumn, endcolumn])
+
+        candidates = [[(OPTION_ADDRESSING_MODE_PAGE, Window(page, startcolumn, page, endcolumn))
+                       for page, startcolumn, endcolumn in merged]]
+
+        # Horizontal windows - greedily merge the pair of rectangles that saves the most
+        rects = [[page, startcolumn, page, endcolumn] for page, startcolumn, endcolumn in merged]
+        while len(rects) > 1:
+            best = None
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    rect = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    saving = self._rect_cost(a) + self._rect_cost(b) - self._rect_cost(rect)
+                    if saving > 0 and (best is None or saving > best[0]) and spannable(Window(*rect)):
+                        best = (saving, i, j, rect)
+            if best is None:
+                break
+            _, i, j, rect = best
+            rects = [r for k, r in enumerate(rects) if k not in (i, j) and not (
+                rect[0] <= r[0] and r[2] <= rect[2] and rect[1] <= r[1] and r[3] <= rect[3])]
+            rects.append(rect)
+        candidates.append([(OPTION_ADDRESSING_MODE_HORIZONTAL, Window(*rect)) for rect in sorted(rects)])
+
+        # One window over everything changed, a full frame in the limit
+        bounds = Window(min(run[0] for run in merged), min(run[1] for run in merged),
+                        max(run[0] for run in merged), max(run[2] for run in merged))
+        if spannable(bounds):
+            candidates.append([(OPTION_ADDRESSING_MODE_HORIZONTAL, bounds)])
+
+        return min(candidates, key=self.cost)
+
 class Layout:
-    def __init__(self, pages, columns):
+    def __init__(self, pages, columns, planner: Union[None, Planner] = None, share: Union[None, 'Layout'] = None):
         self.pages = pages
         self.columns = columns
         self.tiles = []
-
-    def add_tile(self, startpage, startcolumn, endpage, endcolumn):
+        if share is not None:
+            # Another arrangement of tiles on the same panel - one shadow, so switching between them diffs
+            if (share.pages, share.columns) != (pages, columns):
+                raise ValueError(f'Cannot share a {share.pages}x{share.columns} panel with a {pages}x{columns} layout')
+            self.planner = share.planner
+            self._shadow, self._known, self._lock = share._shadow, share._known, share._lock
+        else:
+            self.planner = planner if planner is not None else Planner(pages, columns)
+            # Panel GDDRAM as last sent (page-major) and which of its bytes are known to match the panel
+            self._shadow = bytearray(pages * columns)
+            self._known = bytearray(pages * columns)
+            # Guards the shadow, planner and batch state - taken before any tile lock, never while holding one
+            self._lock = threading.RLock()
+        # Tiles that became dirty since they were last copied, in order - wakes a Flusher
+        self._queue : Dict[Tile, None] = {}
+        self._queue_ready = threading.Condition()
+        # Open batch() contexts and the last flush callback seen inside them
+        self._batch_depth = 0
+        self._batch_callback : Union[None, Callable[[Window, memoryview], bool]] = None
+        self.deferred = 0       # Changed bytes the last budgeted commit held back for a later frame
+        self._compositors = []  # compositing.Compositor per layered tile, composited before each commit
+
+    def add_tile(self, startpage, startcolumn, endpage, endcolumn, priority: int = PRIORITY_NORMAL):
         if startpage < 0 or startpage >= self.pages:
             raise ValueError(f'Start page {startpage} out of range (0-{self.pages-1})')
 
@@ -167,13 +414,348 @@ class Layout:
         for tile in self.tiles:
             if tile_.overlaps(tile):
                 raise ValueError(f'{str(tile_).split(chr(0x0a))[0]} overlaps with existing tile: {str(tile).split(chr(0x0a))[0]}')
+        tile_._layout = self
+        tile_.priority = priority
         self.tiles.append(tile_)
 
-    def clear(self, callback: Callable[[Tile, List[int]], bool]):
+    def _enqueue(self, tile: Tile):
+        with self._queue_ready:
+            self._queue[tile] = None
+            self._queue_ready.notify_all()
+
+    def wait_dirty(self, timeout: Union[None, float] = None) -> bool:
+        # Blocks until some tile is dirty - True if one is
+        with self._queue_ready:
+            return self._queue_ready.wait_for(lambda: self._queue, timeout)
+
+    def _snapshot(self, force: bool = False) -> List[Tuple[Tile, Tile]]:
+        # (tile, copy) for every queued tile, or every tile when forced
+        with self._queue_ready:
+            queued, self._queue = self._queue, {}
+        return [(tile, tile._snapshot()) for tile in (self.tiles if force else queued)]
+
+    @staticmethod
+    def _restore(snapshots: List[Tuple[Tile, Tile]]):
+        # Whatever a copy still has dirty was not sent - put it back on the tile for the next flush
+        for tile, copy in snapshots:
+            if copy._dirty is not None:
+                tile._mark_dirty(*copy._dirty)
+
+    def invalidate(self, window: Union[None, Window] = None):
+        # Forget what the panel shows, e.g. after something else wrote to it
+        if window is None:
+            self._known[:] = bytes(len(self._known))
+            return
+        for page in range(window.startpage, window.endpage + 1):
+            offset = page * self.columns
+            self._known[offset + window.startcolumn:offset + window.endcolumn + 1] = bytes(window.width)
+
+    @contextmanager
+    def batch(self, transport: Union[None, Callable[[bytes, bytes], bool]] = None, budget: Union[None, int] = None):
+        """
+        Defers tile flushes until the outermost batch exits, then sends everything as one plan.
+        With a transport this is commit(transport, budget=budget), otherwise the last flush callback gets the planned windows.
+        Nothing is sent if the block raises - the changes stay pending.
+        """
+        if transport is not None and not callable(transport):
+            raise TypeError('Transport must be callable')
+
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._batch_callback = None
+            raise
+
+        with self._lock:
+            self._batch_depth -= 1
+            if self._batch_depth:
+                return
+            callback, self._batch_callback = self._batch_callback, None
+            if transport is not None:
+                ok = self.commit(transport, budget=budget)
+            elif callback is not None:
+                ok = self._commit(lambda mode, window, data: callback(window, data))
+                self.planner.mode = None
+            else:
+                return
+        if not ok:
+            raise RuntimeError('Failed to flush batch')
+
+    def _diff_runs(self, tile: Tile, page: int, mincolumn: int, maxcolumn: int) -> List[Tuple[int, int]]:
+        # Tile-relative column runs on a tile-relative page that differ from the shadow
+        return self._changed_runs(tile._data[page], (tile.startpage + page) * self.columns + tile.startcolumn,
+                                  mincolumn, maxcolumn)
+
+    def _changed_runs(self, row, offset: int, mincolumn: int, maxcolumn: int) -> List[Tuple[int, int]]:
+        # Column runs of `row` that differ from the shadow starting at `offset`, short gaps bridged
+        start, end = offset + mincolumn, offset + maxcolumn + 1
+        if self._known.find(0, start, end) == -1 and row[mincolumn:maxcolumn + 1] == self._shadow[start:end]:
+            return []
+
+        runs = []
+        for column in range(mincolumn, maxcolumn + 1):
+            if row[column] == self._shadow[offset + column] and self._known[offset + column]:
+                continue
+            if runs and column - runs[-1][1] - 1 < WINDOW_OVERHEAD:
+                runs[-1][1] = column
+            else:
+                runs.append([column, column])
+        return [tuple(run) for run in runs]
+
+    def flush_tile(self, tile: Tile, callback: Callable[[Window, memoryview], bool], force: bool = False) -> bool:
+        if not callable(callback):
+            raise TypeError('Callback must be callable')
+
+        with self._lock:
+            if self._batch_depth:
+                # Sent when the batch exits
+                self._batch_callback = callback
+                if force:
+                    self.invalidate(tile)
+                    tile._mark_dirty(0, 0, tile.height - 1, tile.width - 1)
+                return True
+
+            snapshot = tile._snapshot()
+            if not self._flush_copy(snapshot, callback, force):
+                self._restore([(tile, snapshot)])
+                return False
+            return True
+
+    def _flush_copy(self, tile: Tile, callback: Callable[[Window, memoryview], bool], force: bool) -> bool:
+        # Sends a tile copy window by window through the callback, tracking the shadow
+        if force:
+            span = [0, 0, tile.height - 1, tile.width - 1]
+            windows = [tuple(span)]
+        elif tile._dirty is None:
+            print('Nothing to flush')
+            return True
+        else:
+            span = tile._dirty
+            # Runs per page, then pages with identical runs stacked into one window
+            windows = []
+            for page in range(span[0], span[2] + 1):
+                for mincolumn, maxcolumn in self._diff_runs(tile, page, span[1], span[3]):
+                    for window in windows:
+                        if window[2] == page - 1 and window[1] == mincolumn and window[3] == maxcolumn:
+                            window[2] = page
+                            break
+                    else:
+                        windows.append([page, mincolumn, page, maxcolumn])
+
+        for minpage, mincolumn, maxpage, maxcolumn in windows:
+            window = Window(tile.startpage + minpage, tile.startcolumn + mincolumn,
+                            tile.startpage + maxpage, tile.startcolumn + maxcolumn)
+            if not callback(window, tile._window_data(minpage, mincolumn, maxpage, maxcolumn)):
+                return False
+            for page in range(minpage, maxpage + 1):
+                offset = (tile.startpage + page) * self.columns + tile.startcolumn
+                self._shadow[offset + mincolumn:offset + maxcolumn + 1] = tile._data[page][mincolumn:maxcolumn + 1]
+                self._known[offset + mincolumn:offset + maxcolumn + 1] = b'\x01' * (maxcolumn - mincolumn + 1)
+
+        tile._dirty = None
+        # The callback may leave the panel in any addressing mode
+        self.planner.mode = None
+
+        return True
+
+    def _covered(self, tiles: List[Tile]) -> bytearray:
+        # 1 where one of `tiles` covers the panel
+        covered = bytearray(self.pages * self.columns)
+        for tile in tiles:
+            for page in range(tile.startpage, tile.endpage + 1):
+                offset = page * self.columns
+                covered[offset + tile.startcolumn:offset + tile.endcolumn + 1] = b'\x01' * tile.width
+        return covered
+
+    def _spannable(self, window: Window, covered: bytearray) -> bool:
+        # Every byte is either in a tile being sent or known from the shadow, so it can be re-sent as is
+        for page in range(window.startpage, window.endpage + 1):
+            start = page * self.columns + window.startcolumn
+            end = start + window.width
+            if covered.find(0, start, end) == -1:
+                continue
+            if any(not covered[i] and not self._known[i] for i in range(start, end)):
+                return False
+        return True
+
+    def _frame(self, window: Window, tiles: List[Tile]) -> bytes:
+        # Pending page-major content of a window - bytes of the tiles being sent, shadow elsewhere
+        data = bytearray()
+        for page in range(window.startpage, window.endpage + 1):
+            offset = page * self.columns
+            row = bytearray(self._shadow[offset + window.startcolumn:offset + window.endcolumn + 1])
+            for tile in tiles:
+                if tile.startpage <= page <= tile.endpage and tile.overlaps(window):
+                    start = max(tile.startcolumn, window.startcolumn)
+                    end = min(tile.endcolumn, window.endcolumn)
+                    row[start - window.startcolumn:end - window.startcolumn + 1] = \
+                        tile._data[page - tile.startpage][start - tile.startcolumn:end - tile.startcolumn + 1]
+            data += row
+        return bytes(data)
+
+    def _pending_runs(self, tiles: List[Tile], force: bool = False) -> List[Tuple[Tile, List[Tuple[int, int, int]]]]:
+        # Absolute (page, startcolumn, endcolumn) runs that differ from the shadow, per tile
+        pending = []
+        for tile in tiles:
+            if force:
+                pending.append((tile, [(tile.startpage + page, tile.startcolumn, tile.endcolumn) for page in range(tile.height)]))
+                continue
+            if tile._dirty is None:
+                continue
+            minpage, mincolumn, maxpage, maxcolumn = tile._dirty
+            runs = []
+            for page in range(minpage, maxpage + 1):
+                runs += [(tile.startpage + page, tile.startcolumn + startcolumn, tile.startcolumn + endcolumn)
+                         for startcolumn, endcolumn in self._diff_runs(tile, page, mincolumn, maxcolumn)]
+            pending.append((tile, runs))
+        return pending
+
+    def _budget_runs(self, pending: List[Tuple[Tile, List[Tuple[int, int, int]]]], budget: Union[None, int]):
+        """
+        Picks the runs for this frame - urgent tiles always, then by priority while the budget lasts.
+        The run that overflows is split and the rest is held back. Returns (runs, held back runs).
+        """
+        if budget is None:
+            return [run for _, runs in pending for run in runs], []
+
+        # A run on its own costs a page addressing window plus its bytes
+        window = self.planner.transaction_cost + 2 * 3 + 1
+        selected, held = [], []
+        spent = 0
+        for tile, runs in sorted(pending, key=lambda item: -item[0].priority):
+            for page, startcolumn, endcolumn in runs:
+                cost = window + endcolumn - startcolumn + 1
+                if tile.priority >= PRIORITY_URGENT or spent + cost <= budget:
+                    selected.append((page, startcolumn, endcolumn))
+                    spent += cost
+                elif budget - spent > window:
+                    split = startcolumn + budget - spent - window
+                    selected.append((page, startcolumn, split - 1))
+                    held.append((tile, page, split, endcolumn))
+                    spent = budget
+                else:
+                    held.append((tile, page, startcolumn, endcolumn))
+        return selected, held
+
+    def commit(self, transport: Callable[[bytes, bytes], bool], force: bool = False, budget: Union[None, int] = None) -> bool:
+        """
+        Sends every pending change as planned Co-bit transactions - transport(commands, data) -> bool,
+        e.g. lcd_update.send_transaction or a bound ch347bus.I2CDevice.write_transaction.
+        With a `budget` (cost model bytes, see bus_budget) lower priority changes beyond it wait for the next commit.
+        """
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+
+        def send(mode, window, data):
+            if not transport(bytes(self.planner.commands(mode, window)), data):
+                self.planner.mode = None
+                return False
+            return True
+
+        with self._lock:
+            return self._commit(send, force, budget)
+
+    def _commit(self, send: Callable[[int, Window, bytes], bool], force: bool = False, budget: Union[None, int] = None) -> bool:
+        # Sends from copies of the dirty tiles so producers can keep drawing, then hands back what was not sent
+        for compositor in self._compositors:
+            compositor.composite()
+        snapshots = self._snapshot(force)
+        try:
+            return self._send_plan(send, [copy for _, copy in snapshots], force, budget)
+        finally:
+            self._restore(snapshots)
+
+    def _send_plan(self, send: Callable[[int, Window, bytes], bool], tiles: List[Tile], force: bool = False,
+                   budget: Union[None, int] = None) -> bool:
+        # Plans the pending runs and hands each window to send(mode, window, data), tracking the shadow
+        runs, held = self._budget_runs(self._pending_runs(tiles, force), budget)
+        self.deferred = sum(endcolumn - startcolumn + 1 for _, _, startcolumn, endcolumn in held)
+        covered = self._covered(tiles)
+        for mode, window in self.planner.plan(runs, lambda window: self._spannable(window, covered)):
+            data = self._frame(window, tiles)
+            if not send(mode, window, data):
+                return False
+            for i, page in enumerate(range(window.startpage, window.endpage + 1)):
+                offset = page * self.columns
+                self._shadow[offset + window.startcolumn:offset + window.endcolumn + 1] = \
+                    data[i * window.width:(i + 1) * window.width]
+                self._known[offset + window.startcolumn:offset + window.endcolumn + 1] = b'\x01' * window.width
+
+        # Held back runs keep their tile dirty, the shadow diff finds what is still to send
+        waiting = set()
+        for tile, page, startcolumn, endcolumn in held:
+            waiting.add(tile)
+            if force:
+                self.invalidate(Window(page, startcolumn, page, endcolumn))
+                tile._mark_dirty(0, 0, tile.height - 1, tile.width - 1)
+        for tile in tiles:
+            if tile not in waiting:
+                tile._dirty = None
+        return True
+
+    def capture(self) -> bytes:
+        """
+        Snapshot of the whole panel as the tiles draw it now, page-major and blank outside the tiles.
+        Nothing is sent - render a screen, capture it, and show() it whenever it is needed again.
+        """
+        frame = bytearray(self.pages * self.columns)
+        for tile in self.tiles:
+            with tile.lock:
+                for page in range(tile.height):
+                    offset = (tile.startpage + page) * self.columns + tile.startcolumn
+                    frame[offset:offset + tile.width] = tile._data[page]
+        return bytes(frame)
+
+    def show(self, frame: bytes, transport: Callable[[bytes, bytes], bool]) -> bool:
+        """
+        Puts a captured screen on the panel, sending only what differs from the shadow.
+        The tiles take the screen as their content, so later draws diff against it.
+        """
+        if len(frame) != self.pages * self.columns:
+            raise ValueError(f'Frame of {len(frame)} bytes does not fit a {self.pages}x{self.columns} panel')
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+
+        with self._lock:
+            view = memoryview(frame)
+            runs = []
+            for page in range(self.pages):
+                offset = page * self.columns
+                runs += [(page, startcolumn, endcolumn) for startcolumn, endcolumn
+                         in self._changed_runs(view[offset:offset + self.columns], offset, 0, self.columns - 1)]
+            # The frame defines every byte, so any window may span the gaps between runs
+            for mode, window in self.planner.plan(runs):
+                data = b''.join(view[page * self.columns + window.startcolumn:page * self.columns + window.endcolumn + 1]
+                                for page in range(window.startpage, window.endpage + 1))
+                if not transport(bytes(self.planner.commands(mode, window)), data):
+                    self.planner.mode = None
+                    return False
+                for i, page in enumerate(range(window.startpage, window.endpage + 1)):
+                    offset = page * self.columns
+                    self._shadow[offset + window.startcolumn:offset + window.endcolumn + 1] = \
+                        data[i * window.width:(i + 1) * window.width]
+                    self._known[offset + window.startcolumn:offset + window.endcolumn + 1] = b'\x01' * window.width
+
+            for tile in self.tiles:
+                with tile.lock:
+                    for page in range(tile.height):
+                        offset = (tile.startpage + page) * self.columns + tile.startcolumn
+                        tile._data[page][:] = view[offset:offset + tile.width]
+                    tile._dirty = None
+            with self._queue_ready:
+                self._queue.clear()
+        return True
+
+    def clear(self, callback: Callable[[Window, memoryview], bool]):
         return all(tile.clear(callback) for tile in self.tiles)
 
-    def flush(self, callback: Callable[[Tile, List[int]], bool], force: bool = False) -> bool:
-        return all(tile.flush(callback, force) for tile in self.tiles)
+    def flush(self, callback: Callable[[Window, memoryview], bool], force: bool = False) -> bool:
+        return all(self.flush_tile(tile, callback, force) for tile in self.tiles)
 
     def __repr__(self):
         ret = f'Layout({self.pages}x{self.columns} - {len(self.tiles)} tiles)\n'
@@ -186,20 +768,159 @@ class Layout:
         ret += '<<< layout end\n'
         return ret
 
+class Flusher(threading.Thread):
+    """
+    Commits the layout from a background thread whenever a tile turns dirty, at most `rate` times a second.
+    Producer threads draw their own tiles under the tile lock - each commit sends from atomic copies of the dirty tiles.
+    """
+    def __init__(self, layout: Layout, transport: Callable[[bytes, bytes], bool], rate: float = 30.0,
+                 budget: Union[None, int] = None):
+        super().__init__(name='Flusher', daemon=True)
+        if not isinstance(layout, Layout):
+            raise TypeError(f'Expected Layout, got {type(layout)}')
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+        if rate <= 0:
+            raise ValueError(f'Rate {rate} must be positive')
+
+        self.layout = layout
+        self.transport = transport
+        self.interval = 1 / rate
+        self.budget = budget
+        self.commits = 0
+        self.failures = 0      # Failed commits - their changes stay dirty and are retried
+        self.error : Union[None, Exception] = None     # Last exception a commit raised
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            if not self.layout.wait_dirty(self.interval):
+                continue
+            started = time.monotonic()
+            try:
+                ok = self.layout.commit(self.transport, budget=self.budget)
+            except Exception as e:
+                # A bad frame must not end the thread - its changes stay dirty and the next commit retries
+                self.error = e
+                ok = False
+            self.commits += 1
+            if not ok:
+                self.failures += 1
+            # Frame pacing - whatever producers draw meanwhile goes out together in the next commit
+            self._stopping.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def stop(self, timeout: Union[None, float] = None):
+        self._stopping.set()
+        self.join(timeout)
+
 class Printer:
-    def __init__(self, layout: Layout, truncate: bool = True):
+    def __init__(self, layout: Layout, truncate: bool = True, cache_size: int = 64):
         if not isinstance(layout, Layout):
             raise TypeError(f'Expected Layout, got {type(layout)}')
+        if cache_size < 0:
+            raise ValueError(f'Cache size {cache_size} must not be negative')
 
         self.layout = layout
         self.truncate = truncate
-
-    def __call__(self
-            , tile_index: int
-            , text: Union[str, List[int], List[List[int]]]
-            , font: Union[None, Dict[str, FontBase]]
-            , callback: Callable[[Tile, List[int]], bool]
-        ):
+        # LRU of rendered string text - (text, id(font), tile width, truncate) -> (font, rows, pixel height, full width)
+        self.cache_size = cache_size
+        self._cache : OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Page-major rows per glyph - (id(font), character) -> (font, rows)
+        self._glyphs : Dict[Tuple[int, str], Tuple[Dict[str, FontBase], Tuple[bytes, ...]]] = {}
+        # Last string drawn per tile - tile index -> (font, y, [(character, column offset)], tile buffer after drawing)
+        self._drawn : Dict[int, Tuple[Dict[str, FontBase], int, List[Tuple[str, int]], bytes]] = {}
+        # At most one render waiting per tile - tile index -> (text, font, y), newest wins
+        self._pending : Dict[int, Tuple[Union[str, List[int], List[List[int]]], Union[None, Dict[str, FontBase]], int]] = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.failed : Dict[int, Exception] = {}    # Renders the last render_pending() dropped - tile index -> exception
+        # Guards the cache, counters and pending renders - Printer calls may come from several threads
+        self._lock = threading.Lock()
+
+    def cache_info(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.cache_size}
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def _glyph(self, font: Dict[str, FontBase], c: str) -> Tuple[bytes, ...]:
+        entry = self._glyphs.get((id(font), c))
+        if entry is not None and entry[0] is font:
+            return entry[1]
+        if c not in font:
+            raise ValueError(f'Character {c} not found in font')
+        columns = font[c].get_columns()
+        if not isinstance(columns[0], Iterable):
+            rows = (bytes(columns),)
+        else:
+            rows = tuple(bytes(column[page] for column in columns) for page in range(len(columns[0])))
+        self._glyphs[(id(font), c)] = (font, rows)
+        return rows
+
+    @staticmethod
+    def _height(text: str, font: Dict[str, FontBase], pages: int) -> int:
+        # Pixel rows the text occupies - glyphs shorter than their pages leave the rest untouched
+        return min(pages * 8, max(cls.max_height() for cls in {type(font[c]) for c in text}))
+
+    def _block(self, text: Union[str, List[int], List[List[int]]], font: Union[None, Dict[str, FontBase]],
+               width: int) -> Tuple[Tuple[bytes, ...], int, int]:
+        # Page-major rows (clipped to the tile width when truncating), pixel height and unclipped width
+        key = (text, id(font), width, self.truncate) if isinstance(text, str) else None
+        if key is not None:
+            with self._lock:
+                entry = self._cache.get(key)
+                # The font is kept in the entry so a recycled id() cannot match a different font
+                if entry is not None and entry[0] is font:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return entry[1:]
+                self.misses += 1
+
+        rows = self._render(text, font)
+        height = len(rows) * 8 if font is None else self._height(text, font, len(rows))
+        full_width = len(rows[0])
+        rows = tuple(row[:width] for row in rows) if self.truncate else tuple(rows)
+
+        if key is not None and self.cache_size:
+            with self._lock:
+                self._cache[key] = (font, rows, height, full_width)
+                self._cache.move_to_end(key)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return rows, height, full_width
+
+    def _render(self, text: Union[str, List[int], List[List[int]]], font: Union[None, Dict[str, FontBase]]) -> List[bytes]:
+        # Text to page-major rows - one bytes object per page
+        if font is not None:
+            glyphs = [self._glyph(font, c) for c in text]
+            return [b''.join(glyph[page] for glyph in glyphs) for page in range(len(glyphs[0]))]
+        columns = list(text)
+        if not isinstance(columns[0], Iterable):
+            return [bytes(columns)]
+        return [bytes(column[page] for column in columns) for page in range(len(columns[0]))]
+
+    def _extent(self, text: Union[str, List[int], List[List[int]]], font: Union[None, Dict[str, FontBase]]) -> Tuple[int, int]:
+        # Pixel height and unclipped width without rendering the text
+        if font is not None:
+            glyphs = [self._glyph(font, c) for c in text]
+            return self._height(text, font, len(glyphs[0])), sum(len(glyph[0]) for glyph in glyphs)
+        columns = list(text)
+        pages = len(columns[0]) if isinstance(columns[0], Iterable) else 1
+        return pages * 8, len(columns)
+
+    def _check(self, tile: Tile, y: int, height: int, width: int, warn: bool = True):
+        if y < 0 or y + height > tile.height * 8:
+            raise ValueError(f'Page overflow: {y} + {height} > {tile.height * 8} pixels')
+        if width > tile.width:
+            if not self.truncate:
+                raise ValueError(f'Column overflow: {tile.startcolumn} + {width} > {tile.endcolumn}')
+            if warn:
+                print(f'WARNING: Column overflow truncated: {tile.startcolumn} + {width} > {tile.endcolumn}')
+
+    def _validate(self, tile_index: int, text: Union[str, List[int], List[List[int]]], font: Union[None, Dict[str, FontBase]]) -> Tile:
         if tile_index < 0 or tile_index >= len(self.layout.tiles):
             raise ValueError(f'Tile index {tile_index} out of range (0-{len(self.layout.tiles)-1})')
         tile = self.layout.tiles[tile_index]
@@ -209,49 +930,117 @@ class Printer:
             raise TypeError(f'Text must be a string, got {type(text)}')
         if not text:
             raise ValueError('Text cannot be empty')
+        return tile
+
+    def submit(self
+            , tile_index: int
+            , text: Union[str, List[int], List[List[int]]]
+            , font: Union[None, Dict[str, FontBase]]
+            , y: int = 0
+        ):
+        """
+        Queues a render for the next drain() - latest value wins.
+        A tile holds at most one pending render, so producers faster than the bus never build a backlog.
+        """
+        tile = self._validate(tile_index, text, font)
+        # Missing glyphs and overflow are raised to the producer here, not later in whoever drains
+        height, width = self._extent(text, font)
+        self._check(tile, y, height, width, warn=False)
+        with self._lock:
+            if tile_index in self._pending:
+                self.coalesced += 1
+            self._pending[tile_index] = (text, font, y)
+            self.submitted += 1
+
+    def render_pending(self) -> int:
+        """
+        Draws the newest pending value of every tile without sending anything.
+        A render that fails is dropped and kept in `failed` (tile index -> exception) - the other tiles still draw.
+        """
+        drained = 0
+        self.failed = {}
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                tile_index, (text, font, y) = self._pending.popitem()
+            try:
+                self._draw(tile_index, text, font, y)
+            except Exception as e:
+                self.failed[tile_index] = e
+                continue
+            drained += 1
+        return drained
+
+    def drain(self, transport: Callable[[bytes, bytes], bool]) -> int:
+        # Renders the newest pending value of every tile and sends them all as one planned commit
+        drained = self.render_pending()
+        if not self.layout.commit(transport):
+            raise RuntimeError('Failed to commit layout')
+        if self.failed:
+            tile_index, error = next(iter(self.failed.items()))
+            raise RuntimeError(f'Failed to render tile {tile_index}: {error}' +
+                               (f' (+{len(self.failed) - 1} more)' if len(self.failed) > 1 else ''))
+        return drained
+
+    def __call__(self
+            , tile_index: int
+            , text: Union[str, List[int], List[List[int]]]
+            , font: Union[None, Dict[str, FontBase]]
+            , callback: Callable[[Window, memoryview], bool]
+            , y: int = 0
+        ):
         if not callable(callback):
             raise TypeError('Callback must be callable')
+        tile = self._draw(tile_index, text, font, y)
+        if not tile.flush(callback):
+            raise RuntimeError('Failed to flush tile')
+        return True
+
+    def _draw(self, tile_index: int, text: Union[str, List[int], List[List[int]]], font: Union[None, Dict[str, FontBase]],
+              y: int) -> Tile:
+        tile = self._validate(tile_index, text, font)
+        # A direct draw supersedes anything queued for the tile
+        with self._lock:
+            self._pending.pop(tile_index, None)
 
-        current_column = 0
-        for c in text:
+        with tile.lock:
+            drawn = self._drawn.pop(tile_index, None)
             if font is None:
-                columns = text
-            elif c not in font:
-                raise ValueError(f'Character {c} not found in font')
+                rows, height, width = self._block(text, font, tile.width)
+                self._check(tile, y, height, width)
+                bitmap(tile, 0, y, rows, DRAW_COPY, pixel_height=height)
             else:
-                columns = font[c].get_columns()
-
-            if not self.truncate and current_column + len(columns) > tile.width:
-                raise ValueError(f'Column overflow: {tile.startcolumn} + {current_column} + {len(columns)} > {tile.endcolumn}')
-            if not isinstance(columns[0], Iterable):
-                columns = [[column] for column in columns]
-
-            if len(columns[0]) > tile.height:
-                raise ValueError(f'Page overflow: {tile.startpage} + {len(columns)} > {tile.endpage}')
-
-            for column in columns:
-                for page, byte in enumerate(column):
-                    if not self.truncate and current_column > tile.width:
-                        raise ValueError(f'Column overflow: {tile.startcolumn} + {current_column} + {page} > {tile.endcolumn}')
-                    try:
-                        tile[page, current_column] = byte
-                    except ValueError:
-                        if self.truncate:
-                            print(f'WARNING: Column overflow truncated: {tile.startcolumn} + {current_column} + {page} > {tile.endcolumn}')
+                glyphs = [self._glyph(font, c) for c in text]
+                offsets = [0]
+                for glyph in glyphs:
+                    offsets.append(offsets[-1] + len(glyph[0]))
+                placement = list(zip(text, offsets))
+                # Redraw glyph by glyph only if the tile still holds exactly what was drawn last time
+                if drawn is not None and drawn[0] is font and drawn[1] == y and drawn[3] == tile._buffer:
+                    height = self._height(text, font, len(glyphs[0]))
+                    self._check(tile, y, height, offsets[-1])
+                    for i, (glyph, placed) in enumerate(zip(glyphs, placement)):
+                        if placed[1] >= tile.width:
                             break
-                        else:
-                            raise
-                current_column += 1
-        if not tile.flush(callback):
-            raise RuntimeError('Failed to flush tile')
-        return True
+                        if i < len(drawn[2]) and drawn[2][i] == placed:
+                            continue
+                        bitmap(tile, placed[1], y, glyph, DRAW_COPY, pixel_height=height)
+                else:
+                    rows, height, width = self._block(text, font, tile.width)
+                    self._check(tile, y, height, width)
+                    bitmap(tile, 0, y, rows, DRAW_COPY, pixel_height=height)
+                self._drawn[tile_index] = (font, y, placement, bytes(tile._buffer))
+        return tile
 
 if __name__ == '__main__':
     import time
     import string
 
     from fonts import FontBase, font6x4, font8x9, print_columns
-    from lcd_display import PAGES, COLUMNS, MODE_PAGE, MODE_HORIZONTAL, MODE_VERTICAL
+    from lcd_display import PAGES, COLUMNS
+    from ssd1306 import OPTION_ADDRESSING_MODE_PAGE as MODE_PAGE, \
+        OPTION_ADDRESSING_MODE_HORIZONTAL as MODE_HORIZONTAL, OPTION_ADDRESSING_MODE_VERTICAL as MODE_VERTICAL
     from lcd_update import set_mode, set_page, set_column, write, send_update
 
     N_PAGES = PAGES
@@ -277,12 +1066,12 @@ if __name__ == '__main__':
         for page in range(N_PAGES):
             for column in range(N_COLUMNS):
                 tile1[page, column] = 0xaa
-                layout.flush(lambda row, col, data: write(data))
+                layout.flush(send_update)
                 # time.sleep(0.001)
         for page in range(N_PAGES):
             for column in range(N_COLUMNS):
                 tile1[page, column] = 0x00
-                layout.flush(lambda row, col, data: write(data))
+                layout.flush(send_update)
                 # time.sleep(0.001)
 
     elif mode == MODE_PAGE:
@@ -294,13 +1083,13 @@ if __name__ == '__main__':
             set_page(page)
             for column in range(N_COLUMNS):
                 tile1[page, column] = 0xaa
-                layout.flush(lambda row, col, data: write(data))
+                layout.flush(send_update)
                 # time.sleep(0.001)
         for page in range(N_PAGES):
             set_page(page)
             for column in range(N_COLUMNS):
                 tile1[page, column] = 0x00
-                layout.flush(lambda row, col, data: write(data))
+                layout.flush(send_update)
                 # time.sleep(0.001)
 
     elif mode == MODE_VERTICAL:
@@ -331,7 +1120,7 @@ if __name__ == '__main__':
                     print(f'Column: {column}, Width: {width}')
                     for col in range(column, N_COLUMNS):
                         tile1[page, col] = 0x00
-                    layout.flush(lambda row, col, data: write(data))
+                    layout.flush(send_update)
 
                     page = (page + 1) % N_PAGES
                     column = 0
@@ -345,7 +1134,7 @@ if __name__ == '__main__':
                 column %= N_COLUMNS
                 if column == 0:
                     page = (page + 1) % N_PAGES
-            layout.flush(lambda row, col, data: write(data))
+            layout.flush(send_update)
 
             if font == font6x4:
                 rows = 5
@@ -360,7 +1149,7 @@ if __name__ == '__main__':
 
     for col in range(column, N_COLUMNS):
         tile1[page, col] = 0x00
-    layout.flush(lambda row, col, data: write(data))
+    layout.flush(send_update)
     print(layout)
 
     time.sleep(1)
@@ -1,6 +1,10 @@
 # lcd_display_udp.py
+import selectors
 import socket
+import struct
 import sys
+import time
+from typing import Dict, List, Tuple
 from colorama import init, Cursor
 import shutil
 
@@ -14,6 +18,18 @@ PAGES = 4
 COLUMNS = 128
 ROWS = PAGES * 8
 
+# Decoder counters per panel, returned for a read transaction
+STATS_FIELDS = ('packets', 'bytes', 'errors', 'desyncs')
+STATS_STRUCT = struct.Struct('<4Q')
+
+# Event loop pacing - idle wakeup interval, and datagrams taken per socket before the screen is drawn again
+IDLE_TIMEOUT = 0.1
+MAX_DATAGRAMS = 256
+
+# Terminal cells taken by one panel including its border
+PANEL_HEIGHT = ROWS // 2 + 2
+PANEL_WIDTH = COLUMNS + 2
+
 # UPPER_0 = '˙'
 # LOWER_0 = '.'
 # BOTH_0 = ':'
@@ -55,55 +71,99 @@ printable_row = 0
 printable_row_save = 0
 
 class LCDDisplay:
-    _mode = OPTION_ADDRESSING_MODE_PAGE
-    _display = [[0 for _ in range(COLUMNS)] for _ in range(PAGES)]
-    _current_page1 = 0
-    _current_page2 = 0
-    _current_col1 = 0
-    _current_col2 = 0
-    _current_page = 0
-    _current_col = 0
-    _cmd_buffer = []
-    _n_times = 10  # For debugging purposes
-
-    @staticmethod
-    def set_mode(mode):
+    def __init__(self, address=0x3C, port=12345, origin=(1, 1), headless=False):
+        self.address = address
+        self.port = port
+        self.origin = origin    # (row, column) of the top-left border corner on the terminal
+        self.headless = headless    # Decode only - no drawing, no logging
+        self._mode = OPTION_ADDRESSING_MODE_PAGE
+        self._display = [[0 for _ in range(COLUMNS)] for _ in range(PAGES)]
+        self._current_page1 = 0
+        self._current_page2 = 0
+        self._current_col1 = 0
+        self._current_col2 = 0
+        self._current_page = 0
+        self._current_col = 0
+        self._cmd_buffer = []
+        self._n_times = 10  # For debugging purposes
+        self.stats = dict.fromkeys(STATS_FIELDS, 0)
+        self._dirty = set()     # (page, column) cells written since the last render
+        # Horizontal scroll - (direction, start page, end page, frames per step) as last set up, and whether it runs
+        self._scroll = None
+        self.scrolling = False
+        self._frames = 0.0      # Frames elapsed towards the next scroll step
+
+        # Set initial position
+        self.set_mode(OPTION_ADDRESSING_MODE_PAGE)
+        self.set_page(0x0, PAGES - 1)
+        self.set_col(0x00, COLUMNS - 1)
+
+    def set_mode(self, mode):
         if mode in (OPTION_ADDRESSING_MODE_PAGE, OPTION_ADDRESSING_MODE_HORIZONTAL):
-            LCDDisplay._mode = mode
+            self._mode = mode
         elif mode == OPTION_ADDRESSING_MODE_VERTICAL:
             raise NotImplementedError('Vertical mode is not implemented yet. Use page or horizontal mode instead.')
 
-    @staticmethod
-    def set_page(page1, page2):
+    def set_page(self, page1, page2):
         if 0 <= page1 < PAGES and 0 <= page2 < PAGES:
-            LCDDisplay._current_page1 = page1
-            LCDDisplay._current_page2 = page2
-            LCDDisplay._current_page = page1
+            self._current_page1 = page1
+            self._current_page2 = page2
+            self._current_page = page1
 
-    @staticmethod
-    def set_col(col1, col2):
+    def set_col(self, col1, col2):
         if 0 <= col1 < COLUMNS and 0 <= col2 < COLUMNS:
-            LCDDisplay._current_col1 = col1
-            LCDDisplay._current_col2 = col2
-            LCDDisplay._current_col = col1
+            self._current_col1 = col1
+            self._current_col2 = col2
+            self._current_col = col1
 
-    @staticmethod
-    def _get_cursor(page, col):
+    def _get_cursor(self, page, col):
         if 0 <= page < PAGES and 0 <= col < COLUMNS:
-            return page * 4 + 2, col + 1
+            return self.origin[0] + 1 + page * 4, self.origin[1] + col
         else:
             raise ValueError('Invalid page or column number')
 
-    @staticmethod
-    def write(byte):
-        LCDDisplay._cmd_buffer = []
+    def write(self, byte):
+        if self._cmd_buffer:
+            # Data arrived in the middle of a command - the command is lost
+            self.stats['desyncs'] += 1
+        self._cmd_buffer = []
+
+        self._display[self._current_page][self._current_col] = byte
+        if not self.headless:
+            self._dirty.add((self._current_page, self._current_col))
+
+        self._current_col = self._current_col + 1
+        if self._mode == OPTION_ADDRESSING_MODE_PAGE:
+            # Column window only applies to horizontal/vertical modes - page mode wraps within the page
+            self._current_col %= COLUMNS
+        elif self._current_col > self._current_col2:
+            self._current_col = self._current_col1
+            self._current_page = self._current_page + 1
+        if self._current_page > self._current_page2:
+            self._current_page = self._current_page1
+
+    def _log(self, *args):
+        if not self.headless:
+            print(*args)
+
+    def render(self):
+        # Draw every cell written since the last render in one terminal write
+        if not self._dirty:
+            return
+        out = []
+        for page, column in sorted(self._dirty):
+            self._draw(page, column, out)
+        self._dirty.clear()
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
 
-        LCDDisplay._display[LCDDisplay._current_page][LCDDisplay._current_col] = byte
-        first_double_row, col = LCDDisplay._get_cursor(LCDDisplay._current_page, LCDDisplay._current_col)
+    def _draw(self, page, column, out):
+        byte = self._display[page][column]
+        first_double_row, col = self._get_cursor(page, column)
 
-        if LCDDisplay._n_times:
+        if self._n_times:
             print('N times 1', first_double_row, col, f'{byte:02x}')
-            LCDDisplay._n_times -= 1
+            self._n_times -= 1
 
         for double_row in range(first_double_row, first_double_row + 4):
             bits = byte & 0b1
@@ -118,17 +178,10 @@ class LCDDisplay:
                 char = UPPER_1
             elif bits == 3:
                 char = BOTH_1
-            if LCDDisplay._n_times:
+            if self._n_times:
                 print('N times 2', double_row, col + 1, f'{bits:02b}')
-                LCDDisplay._n_times -= 1
-            LCDDisplay._write_pos(double_row, col + 1, char)
-
-        LCDDisplay._current_col = LCDDisplay._current_col + 1
-        if LCDDisplay._mode == OPTION_ADDRESSING_MODE_HORIZONTAL and LCDDisplay._current_col > LCDDisplay._current_col2:
-            LCDDisplay._current_col = LCDDisplay._current_col1
-            LCDDisplay._current_page = LCDDisplay._current_page + 1
-        if LCDDisplay._current_page > LCDDisplay._current_page2:
-            LCDDisplay._current_page = LCDDisplay._current_page1
+                self._n_times -= 1
+            out.append(Cursor.POS(col + 1, double_row) + char)
 
     @staticmethod
     def clear_screen():
@@ -141,228 +194,358 @@ class LCDDisplay:
         sys.stdout.write(byte)
         sys.stdout.flush()
 
-    @staticmethod
-    def draw_initial_display():
+    def draw_initial_display(self):
         # Top border
-        top_border_row = 1
+        top_border_row = self.origin[0]
         number_of_double_rows = ROWS // 2
         bottom_border_row = top_border_row + 1 + number_of_double_rows
 
-        left_border_col = 1
+        left_border_col = self.origin[1]
         number_of_columns = COLUMNS
         right_border_col = left_border_col + 1 + number_of_columns
 
-        LCDDisplay._write_pos(top_border_row, 1, TOP_LEFT_CORNER)
+        self._write_pos(top_border_row, left_border_col, TOP_LEFT_CORNER)
         for col in range(left_border_col + 1, right_border_col):
-            LCDDisplay._write_pos(top_border_row, col, HORIZONTAL_LINE)
-        LCDDisplay._write_pos(top_border_row, right_border_col, TOP_RIGHT_CORNER)
+            self._write_pos(top_border_row, col, HORIZONTAL_LINE)
+        self._write_pos(top_border_row, right_border_col, TOP_RIGHT_CORNER)
+        # Panel label in the top border
+        for i, char in enumerate(f' {self.port}:0x{self.address:02X} '):
+            self._write_pos(top_border_row, left_border_col + 2 + i, char)
 
         for double_row in range(top_border_row + 1, bottom_border_row):
             # Left border
-            LCDDisplay._write_pos(double_row, left_border_col, VERTICAL_LINE)
+            self._write_pos(double_row, left_border_col, VERTICAL_LINE)
 
             for col in range(left_border_col + 1, right_border_col):
-                LCDDisplay._write_pos(double_row, col, BOTH_0)
+                self._write_pos(double_row, col, BOTH_0)
 
             # Right border
-            LCDDisplay._write_pos(double_row, right_border_col, VERTICAL_LINE)
+            self._write_pos(double_row, right_border_col, VERTICAL_LINE)
 
         # Bottom border
-        LCDDisplay._write_pos(bottom_border_row, 1, BOTTOM_LEFT_CORNER)
+        self._write_pos(bottom_border_row, left_border_col, BOTTOM_LEFT_CORNER)
         for col in range(left_border_col + 1, right_border_col):
-            LCDDisplay._write_pos(bottom_border_row, col, HORIZONTAL_LINE)
-        LCDDisplay._write_pos(bottom_border_row, right_border_col, BOTTOM_RIGHT_CORNER)
+            self._write_pos(bottom_border_row, col, HORIZONTAL_LINE)
+        self._write_pos(bottom_border_row, right_border_col, BOTTOM_RIGHT_CORNER)
 
         return bottom_border_row + 1
 
-    @staticmethod
-    def parse_command(data):
-        LCDDisplay._cmd_buffer += list(data)
+    def parse_command(self, data):
+        self._cmd_buffer += list(data)
         for cmd in SSD1306_COMMANDS:
             try:
-                cmd.parse(LCDDisplay._cmd_buffer)
+                cmd.parse(self._cmd_buffer)
                 break
             except AssertionError:
                 pass
         else:
-            if len(LCDDisplay._cmd_buffer) > 7:
-                LCDDisplay._cmd_buffer = LCDDisplay._cmd_buffer[1:]
-                LCDDisplay.parse_command([])
-            # print('\tWaiting for command to complete...')
+            if len(self._cmd_buffer) > 7:
+                self.stats['desyncs'] += 1
+                self._cmd_buffer = self._cmd_buffer[1:]
+                self.parse_command([])
+            # self._log('\tWaiting for command to complete...')
             return False
 
-        context, LCDDisplay._cmd_buffer = cmd.parse(LCDDisplay._cmd_buffer)
+        if isinstance(cmd, Command):
+            context, self._cmd_buffer = None, cmd.parse(self._cmd_buffer)
+        else:
+            *context, self._cmd_buffer = cmd.parse(self._cmd_buffer)
+            context = context[0] if len(context) == 1 else tuple(context)   # (option, args) for scroll setup
         if cmd is SSD1306_I2C_ADDRESS:
-            print('I2C address:', context)
+            self._log('I2C address:', context)
             return True
         if cmd is SSD1306_SETCONTRAST:
-            print('Contrast:', context)
+            self._log('Contrast:', context)
             return True
         if cmd is SSD1306_DISPLAY:
             if context == OPTION_DISPLAY_ALLON_CLEAR:
-                print('Display all on clear')
+                self._log('Display all on clear')
             elif context == OPTION_DISPLAY_ALLON_RESUME:
-                print('Display all on resume')
+                self._log('Display all on resume')
             elif context == OPTION_DISPLAY_NORMAL:
-                print('Display normal')
+                self._log('Display normal')
             elif context == OPTION_DISPLAY_INVERT:
-                print('Display inverse')
+                self._log('Display inverse')
             elif context == OPTION_DISPLAY_OFF:
-                print('Display off')
+                self._log('Display off')
             elif context == OPTION_DISPLAY_ON:
-                print('Display on')
+                self._log('Display on')
             else:
-                print('Display:', context)
+                self._log('Display:', context)
             return True
         if cmd is SSD1306_SCROLL_HORIZONTAL:
-            print('Scroll horizontal:', context)
+            self._log('Scroll horizontal:', context)
+            direction, (_, start, interval, end, _, _) = context
+            if self.scrolling:
+                # Setting up while scrolling is not allowed - the controller's RAM would be corrupted
+                self.stats['errors'] += 1
+            self._scroll = (direction, start, end, SCROLL_INTERVAL_FRAMES[interval])
             return True
         if cmd is SSD1306_SCROLL_HORIZONTAL_VERTICAL:
-            print('Scroll horizontal vertical:', context)
+            self._log('Scroll horizontal vertical:', context)
             return True
         if cmd is SSD1306_SCROLL_DEACTIVATE:
-            print('Scroll deactivate:', context)
+            self._log('Scroll deactivate:', context)
+            self.scrolling = False
             return True
         if cmd is SSD1306_SCROLL_ACTIVATE:
-            print('Scroll activate:', context)
+            self._log('Scroll activate:', context)
+            if self._scroll is None or self._scroll[1] > self._scroll[2]:
+                self._log('Scroll activate without a valid setup')
+                return True
+            self.scrolling = True
+            self._frames = 0.0
             return True
         if cmd is SSD1306_SET_VERTICAL_SCROLL_AREA:
-            print('Set vertical scroll area:', context)
+            self._log('Set vertical scroll area:', context)
             return True
         if cmd is SSD1306_SET_MEMORY_ADDRESSING_MODE:
-            print('Set memory addressing mode:', context)
+            self._log('Set memory addressing mode:', context)
             if context[0] == OPTION_ADDRESSING_MODE_HORIZONTAL:
-                LCDDisplay.set_mode(OPTION_ADDRESSING_MODE_HORIZONTAL)
-            elif context == OPTION_ADDRESSING_MODE_VERTICAL:
-                LCDDisplay.set_mode(OPTION_ADDRESSING_MODE_VERTICAL)
-            elif context == OPTION_ADDRESSING_MODE_PAGE:
-                LCDDisplay.set_mode(OPTION_ADDRESSING_MODE_PAGE)
+                self.set_mode(OPTION_ADDRESSING_MODE_HORIZONTAL)
+            elif context[0] == OPTION_ADDRESSING_MODE_VERTICAL:
+                self.set_mode(OPTION_ADDRESSING_MODE_VERTICAL)
+            elif context[0] == OPTION_ADDRESSING_MODE_PAGE:
+                self.set_mode(OPTION_ADDRESSING_MODE_PAGE)
             else:
-                print('Invalid addressing mode:', context)
+                self._log('Invalid addressing mode:', context)
             return True
         if cmd is SSD1306_PA_MODE_SET_PAGE_ADDR:
-            print('Page address:', context)
-            LCDDisplay.set_page(context, PAGES - 1)
+            self._log('Page address:', context)
+            self.set_page(context, PAGES - 1)
             return True
         if cmd is SSD1306_PA_MODE_SET_COLUMN_ADDR_LOW:
-            print('Column address low:', context)
-            LCDDisplay.set_col(LCDDisplay._current_col1 & 0xF0 | context[0] & 0x0F, LCDDisplay._current_col2)
+            self._log('Column address low:', context)
+            self._current_col = self._current_col & 0xF0 | context & 0x0F
             return True
         if cmd is SSD1306_PA_MODE_SET_COLUMN_ADDR_HIGH:
-            print('Column address high:', context)
-            LCDDisplay.set_col(LCDDisplay._current_col1 & 0x0F | context[0] & 0xF0, LCDDisplay._current_col2)
+            self._log('Column address high:', context)
+            self._current_col = self._current_col & 0x0F | (context & 0x07) << 4
             return True
         if cmd is SSD1306_HAVA_MODE_SET_PAGE_ADDR:
-            print('Page address:', context)
-            LCDDisplay.set_page(context[0], context[1])
+            self._log('Page address:', context)
+            self.set_page(context[0], context[1])
             return True
         if cmd is SSD1306_HAVA_MODE_SET_COLUMN_ADDR:
-            print('Column address:', context)
-            LCDDisplay.set_col(context[0], context[1])
+            self._log('Column address:', context)
+            self.set_col(context[0], context[1])
             return True
         if cmd is SSD1306_SET_START_LINE:
-            print('Set start line:', context)
-            LCDDisplay.set_col(context, LCDDisplay._current_col2)
+            self._log('Set start line:', context)
+            self.set_col(context, self._current_col2)
             return True
         if cmd is SSD1306_SEGMENT_REMAP:
-            print('Segment remap:', context)
+            self._log('Segment remap:', context)
             return True
         if cmd is SSD1306_SET_MULTIPLEX:
-            print('Set multiplex:', context)
+            self._log('Set multiplex:', context)
             return True
         if cmd is SSD1306_COM_OUTPUT_SCAN_DIR:
-            print('COM output scan direction:', context)
+            self._log('COM output scan direction:', context)
             return True
         if cmd is SSD1306_SET_DISPLAY_OFFSET:
-            print('Set display offset:', context)
-            LCDDisplay.set_page(context[0], LCDDisplay._current_page2)
+            self._log('Set display offset:', context)
+            self.set_page(context[0], self._current_page2)
             return True
         if cmd is SSD1306_SET_COM_PINS:
-            print('Set COM pins:', context)
+            self._log('Set COM pins:', context)
             return True
         if cmd is SSD1306_SET_DISPLAY_CLOCK_DIV_RATIO:
-            print('Set display clock div ratio:', context)
+            self._log('Set display clock div ratio:', context)
             return True
         if cmd is SSD1306_SET_PRECHARGE_PERIOD:
-            print('Set precharge period:', context)
+            self._log('Set precharge period:', context)
             return True
         if cmd is SSD1306_SET_VCOM_DESELECT_LEVEL:
-            print('Set VCOM deselect level:', context)
+            self._log('Set VCOM deselect level:', context)
             return True
         if cmd is SSD1306_NOP:
-            print('No operation:', context)
+            self._log('No operation:', context)
             return True
         if cmd is SSD1306_CHARGE_PUMP:
-            print('Charge pump:', context)
+            self._log('Charge pump:', context)
             return True
         if cmd is SSD1306_EXTERNAL_VCC:
-            print('External VCC:', context)
+            self._log('External VCC:', context)
             return True
         if cmd is SSD1306_SWITCH_CAP_VCC:
-            print('Switch cap VCC:', context)
+            self._log('Switch cap VCC:', context)
             return True
         if cmd is SSD1306_SET_PRECHARGE_PERIOD:
-            print('Set precharge period:', context)
+            self._log('Set precharge period:', context)
             return True
         if cmd is SSD1306_SET_VCOM_DESELECT_LEVEL:
-            print('Set VCOM deselect level:', context)
+            self._log('Set VCOM deselect level:', context)
             return True
         raise NotImplementedError(f'Command {cmd} not implemented yet.')
 
-def main():
+    def advance(self, frames: float):
+        # Runs the panel clock - an active horizontal scroll rotates its pages (GDDRAM included) one column per step
+        if not self.scrolling:
+            return
+        direction, start, end, interval = self._scroll
+        self._frames += frames
+        steps, self._frames = divmod(self._frames, interval)
+        steps = int(steps) % COLUMNS
+        if not steps:
+            return
+        if direction == OPTION_HORIZONTAL_SCROLL_LEFT:
+            steps = COLUMNS - steps
+        for page in range(start, end + 1):
+            row = self._display[page]
+            row[:] = row[-steps:] + row[:-steps]
+            if not self.headless:
+                self._dirty.update((page, column) for column in range(COLUMNS))
+
+    def feed(self, stream):
+        # Write transaction without the slave address - control byte(s), commands and data
+        self.stats['packets'] += 1
+        self.stats['bytes'] += len(stream)
+        try:
+            for is_data, segment in decode_control_stream(stream):
+                if not is_data:
+                    self.parse_command(segment)
+                    # Several commands can share one control segment
+                    while self._cmd_buffer and self.parse_command([]):
+                        pass
+                    continue
+                self._log('Data: ', ''.join(f'{byte:02x}' for byte in segment))
+                self._log(self._current_page, self._current_col)
+                for byte in segment:
+                    self.write(byte)
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+
+class LCDEmulator:
+    def __init__(self, grid_columns=1, headless=False):
+        if grid_columns < 1:
+            raise ValueError(f'Grid columns {grid_columns} must be at least 1')
+        self.grid_columns = grid_columns
+        self.headless = headless
+        self.panels : Dict[Tuple[int, int], LCDDisplay] = {}
+
+    @property
+    def ports(self) -> List[int]:
+        return sorted({port for port, _ in self.panels})
+
+    @property
+    def height(self) -> int:
+        rows = (len(self.panels) + self.grid_columns - 1) // self.grid_columns
+        return rows * (PANEL_HEIGHT + 1)
+
+    @property
+    def width(self) -> int:
+        columns = min(len(self.panels), self.grid_columns)
+        return columns * (PANEL_WIDTH + 1)
+
+    def add_panel(self, port=12345, address=0x3C) -> LCDDisplay:
+        if (port, address) in self.panels:
+            raise ValueError(f'Panel 0x{address:02X} already registered on port {port}')
+        row, column = divmod(len(self.panels), self.grid_columns)
+        origin = (1 + row * (PANEL_HEIGHT + 1), 1 + column * (PANEL_WIDTH + 1))
+        panel = LCDDisplay(address, port, origin, self.headless)
+        self.panels[(port, address)] = panel
+        return panel
+
+    def draw_initial_display(self):
+        for panel in self.panels.values():
+            panel.draw_initial_display()
+        return self.height + 1
+
+    def render(self):
+        for panel in self.panels.values():
+            panel.render()
+
+    def feed(self, port, data) -> bool:
+        # Full datagram - slave address followed by the transaction
+        if not data:
+            return False
+        panel = self.panels.get((port, data[0] >> 1))
+        if panel is None:
+            return False
+        if data[0] & 1:
+            print('Read mode')
+            raise NotImplementedError('Read mode is not implemented yet.')
+        panel.feed(data[1:])
+        return True
+
+    def advance(self, seconds: float):
+        for panel in self.panels.values():
+            panel.advance(seconds * FRAME_RATE)
+
+    @property
+    def scrolling(self) -> bool:
+        return any(panel.scrolling for panel in self.panels.values())
+
+    def read(self, port, address) -> bytes:
+        # Emulator extension - a read transaction returns the panel's decoder counters
+        panel = self.panels.get((port, address))
+        if panel is None:
+            raise ValueError(f'No panel 0x{address:02X} on port {port}')
+        return STATS_STRUCT.pack(*(panel.stats[field] for field in STATS_FIELDS))
+
+def main(panels=((12345, 0x3C),), grid_columns=1):
     global printable_row
     global printable_row_save
 
-    assert PAGES <= TERM_HEIGHT, 'Terminal height is too small for the display'
-    assert COLUMNS <= TERM_WIDTH, 'Terminal width is too small for the display'
+    emulator = LCDEmulator(grid_columns)
+    for port, address in panels:
+        emulator.add_panel(port, address)
+
+    assert emulator.height <= TERM_HEIGHT, 'Terminal height is too small for the display'
+    assert emulator.width <= TERM_WIDTH, 'Terminal width is too small for the display'
 
     assert ROWS & 1 == 0, 'ROWS must be even'
     assert COLUMNS & 1 == 0, 'COLUMNS must be even'
 
     LCDDisplay.clear_screen()
-    printable_row = LCDDisplay.draw_initial_display()
+    printable_row = emulator.draw_initial_display()
     printable_row_save = printable_row
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('0.0.0.0', 12345))
-    sock.settimeout(0.1)  # Set a timeout for the socket
-    print('Listening for UDP packets on port 12345...')
-
-    # Set initial position
-    LCDDisplay.set_mode(OPTION_ADDRESSING_MODE_PAGE)
-    LCDDisplay.set_page(0x0, PAGES - 1)
-    LCDDisplay.set_col(0x00, COLUMNS - 1)
+    selector = selectors.DefaultSelector()
+    for port in emulator.ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('0.0.0.0', port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, port)
+        print(f'Listening for UDP packets on port {port}...')
+
+    buffer = bytearray(65536)   # Largest UDP payload, reused for every datagram
+    view = memoryview(buffer)
+    clock = time.monotonic()
     try:
         while True:
-            try:
-                data, _ = sock.recvfrom(1024)
-                if not data:
-                    continue
-                data = list(data)
-                if data[0] >> 1 != 0x3C:
-                    continue
-                if data[0] & 1 == 0:
-                    if data[1] == 0x00:
-                        LCDDisplay.parse_command(data[2:])
-                    else:
-                        print('Data: ', ''.join(f'{byte:02x}' for byte in data))
-                        print(LCDDisplay._current_page, LCDDisplay._current_col)
-                        for byte in data[2:]:
-                            LCDDisplay.write(byte)
-                else:
-                    print('Read mode')
-                    raise NotImplementedError('Read mode is not implemented yet.')
-            except socket.timeout:
-                    continue
-            except KeyboardInterrupt:
-                print('Exiting...')
-                break
-            except Exception as e:
-                print(f'Error: {e}')
+            # Wait for datagrams, then take up to MAX_DATAGRAMS per socket before drawing once - wake up every frame while scrolling
+            errors = []
+            events = selector.select(1 / FRAME_RATE if emulator.scrolling else IDLE_TIMEOUT)
+            now = time.monotonic()
+            emulator.advance(now - clock)
+            clock = now
+            for key, _ in events:
+                sock, port = key.fileobj, key.data
+                # A flood must not starve the screen - whatever is left is still readable on the next wakeup
+                for _ in range(MAX_DATAGRAMS):
+                    try:
+                        size, sender = sock.recvfrom_into(buffer)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    try:
+                        if size and buffer[0] & 1:
+                            sock.sendto(emulator.read(port, buffer[0] >> 1), sender)
+                        else:
+                            emulator.feed(port, view[:size])
+                    except Exception as e:
+                        errors.append(e)
+            emulator.render()
+            if errors:
+                print(f'Error: {errors[0]}' + (f' (+{len(errors) - 1} more)' if len(errors) > 1 else ''))
     except KeyboardInterrupt:
         print('Exiting...')
     finally:
-        sock.close()
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
         sys.stdout.write(Cursor.POS(1, TERM_HEIGHT))
 
 with open('display.log', 'w') as f:
@@ -414,4 +597,13 @@ def print(*args, **_):
 # LCDDisplay.parse_command([0x22, 0x00, 0x03])
 
 if __name__ == '__main__':
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SSD1306 terminal emulator')
+    parser.add_argument('--panel', action='append', metavar='PORT:ADDRESS',
+                        help='Virtual panel to host, e.g. 12345:0x3D (repeatable, default 12345:0x3C)')
+    parser.add_argument('--grid', type=int, default=1, metavar='N', help='Panels per row (default 1)')
+    args = parser.parse_args()
+
+    panels = [tuple(int(value, 0) for value in panel.split(':')) for panel in args.panel or ['12345:0x3C']]
+    main(panels, args.grid)
@@ -1,24 +1,54 @@
 # send_lcd_update.py
 import socket
+from typing import Optional
 
-from lcd_display import PAGES, COLUMNS
+from capture import CaptureWriter
+from lcd_display import PAGES, COLUMNS, STATS_FIELDS, STATS_STRUCT
 from ssd1306 import *
 
+_capture : Optional[CaptureWriter] = None
+
+def set_capture(capture: Optional[CaptureWriter]):
+    # Record every message sent, None to stop - the capture being replaced is closed
+    global _capture
+    previous, _capture = _capture, capture
+    if previous is not None and previous is not capture:
+        previous.close()
+
 def send_message(data, host='127.0.0.1', port=12345):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(data, (host, port))
-    sock.close()
+    try:
+        sock.sendto(data, (host, port))
+    finally:
+        sock.close()
+    # Only what actually went out is recorded
+    capture = _capture
+    if capture is not None and len(data) > 1:
+        capture.write_stream(data[0] >> 1, data[1:])
     return True
 
-def set_mode(mode):
+def read_stats(address=0x3C, host='127.0.0.1', port=12345, timeout=1.0):
+    # Emulator only - a read transaction returns the panel's decoder counters, None if nobody answered
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(bytes([address << 1 | 1]), (host, port))
+        reply, _ = sock.recvfrom(STATS_STRUCT.size)
+    except OSError:
+        return None
+    finally:
+        sock.close()
+    return dict(zip(STATS_FIELDS, STATS_STRUCT.unpack(reply)))
+
+def set_mode(mode, address=0x3C, port=12345):
     if mode not in (OPTION_ADDRESSING_MODE_PAGE,
                     OPTION_ADDRESSING_MODE_HORIZONTAL,
                     OPTION_ADDRESSING_MODE_VERTICAL):
         raise ValueError(f'Invalid mode: {mode}.')
     data = SSD1306_SET_MEMORY_ADDRESSING_MODE.get_command(mode)
-    return send_message(bytes([0x3C << 1 | 0] + [0x00] + data))
+    return send_message(bytes([address << 1 | 0] + [0x00] + data), port=port)
 
-def set_page(startpage, endpage=None):
+def set_page(startpage, endpage=None, address=0x3C, port=12345):
     if startpage < 0 or startpage >= PAGES:
         raise ValueError(f'Start page {startpage} out of range (0-{PAGES-1})')
     if endpage is not None:
@@ -31,9 +61,9 @@ def set_page(startpage, endpage=None):
         data = SSD1306_HAVA_MODE_SET_PAGE_ADDR.get_command(startpage, endpage)
     else:
         data = SSD1306_PA_MODE_SET_PAGE_ADDR.get_command(startpage)
-    return send_message(bytes([0x3C << 1 | 0] + [0x00] + data))
+    return send_message(bytes([address << 1 | 0] + [0x00] + data), port=port)
 
-def set_column(startcolumn, endcolumn=None):
+def set_column(startcolumn, endcolumn=None, address=0x3C, port=12345):
     if startcolumn < 0 or startcolumn >= COLUMNS:
         raise ValueError(f'Column {startcolumn} out of range (0-{COLUMNS-1})')
     if endcolumn is not None:
@@ -47,12 +77,23 @@ def set_column(startcolumn, endcolumn=None):
     else:
         data = SSD1306_PA_MODE_SET_COLUMN_ADDR_LOW.get_command(startcolumn & 0x0F)
         data += SSD1306_PA_MODE_SET_COLUMN_ADDR_HIGH.get_command(startcolumn >> 4)
-    return send_message(bytes([0x3C << 1 | 0] + [0x00] + data))
+    return send_message(bytes([address << 1 | 0] + [0x00] + data), port=port)
 
-def write(bytes_ : bytes):
+def write(bytes_ : bytes, address=0x3C, port=12345):
     if not isinstance(bytes_, (bytes, bytearray)):
         raise TypeError(f'Expected bytes or bytearray, got {type(bytes_)}')
     if len(bytes_) == 0:
         raise ValueError('Bytes object is empty')
-    data = bytes([0x3C << 1 | 0] + [0x40] + list(bytes_))
-    return send_message(data)
+    data = bytes([address << 1 | 0] + [0x40] + list(bytes_))
+    return send_message(data, port=port)
+
+def send_transaction(commands=(), data=b'', address=0x3C, port=12345):
+    data = encode_control_stream(commands, data)
+    return send_message(bytes([address << 1 | 0]) + data, port=port)
+
+def send_update(tile, bytes_ : bytes, address=0x3C, port=12345) -> bool:
+    # Addressing mode, page window, column window and data in a single transaction
+    commands = SSD1306_SET_MEMORY_ADDRESSING_MODE.get_command(OPTION_ADDRESSING_MODE_HORIZONTAL)
+    commands += SSD1306_HAVA_MODE_SET_PAGE_ADDR.get_command(tile.startpage, tile.endpage)
+    commands += SSD1306_HAVA_MODE_SET_COLUMN_ADDR.get_command(tile.startcolumn, tile.endcolumn)
+    return send_transaction(commands, bytes(bytes_), address, port)
@@ -0,0 +1,130 @@
+# loadgen.py
+import random
+import time
+from typing import Callable, Dict
+
+from lcd_display import PAGES, COLUMNS
+from lcd_update import send_message, send_transaction, read_stats
+from ssd1306 import *
+
+def frame_update(rng: random.Random, address, port):
+    # Full frame in horizontal addressing mode - one transaction
+    commands = SSD1306_SET_MEMORY_ADDRESSING_MODE.get_command(OPTION_ADDRESSING_MODE_HORIZONTAL)
+    commands += SSD1306_HAVA_MODE_SET_PAGE_ADDR.get_command(0, PAGES - 1)
+    commands += SSD1306_HAVA_MODE_SET_COLUMN_ADDR.get_command(0, COLUMNS - 1)
+    return send_transaction(commands, rng.randbytes(PAGES * COLUMNS), address, port)
+
+def page_update(rng: random.Random, address, port):
+    # A few bytes at a random position in page addressing mode
+    length = rng.randint(1, 8)
+    column = rng.randrange(COLUMNS - length + 1)
+    commands = SSD1306_SET_MEMORY_ADDRESSING_MODE.get_command(OPTION_ADDRESSING_MODE_PAGE)
+    commands += SSD1306_PA_MODE_SET_PAGE_ADDR.get_command(rng.randrange(PAGES))
+    commands += SSD1306_PA_MODE_SET_COLUMN_ADDR_LOW.get_command(column & 0x0F)
+    commands += SSD1306_PA_MODE_SET_COLUMN_ADDR_HIGH.get_command(column >> 4)
+    return send_transaction(commands, rng.randbytes(length), address, port)
+
+def command_storm(rng: random.Random, address, port):
+    # Burst of harmless commands with no data
+    commands = []
+    for _ in range(rng.randint(8, 32)):
+        commands += rng.choice([
+            lambda: SSD1306_SETCONTRAST.get_command(rng.randrange(0x100)),
+            lambda: SSD1306_DISPLAY.get_command(rng.choice([OPTION_DISPLAY_NORMAL, OPTION_DISPLAY_INVERT])),
+            lambda: SSD1306_DISPLAY.get_command(OPTION_DISPLAY_ON),
+            lambda: SSD1306_NOP.get_command(),
+        ])()
+    return send_transaction(commands, b'', address, port)
+
+def malformed(rng: random.Random, address, port):
+    # Broken transactions the decoder has to survive
+    header = bytes([address << 1 | 0])
+    return send_message(header + rng.choice([
+        bytes([SSD1306_CONTROL_CO]),                                    # Co bit without its byte
+        bytes([0x3F]) + rng.randbytes(4),                               # Reserved control bits set
+        bytes([SSD1306_CONTROL_COMMAND, 0x22, 0x00]),                   # Command missing its last argument
+        bytes([SSD1306_CONTROL_COMMAND]) + rng.randbytes(rng.randint(1, 16)),
+    ]), port=port)
+
+MIXES : Dict[str, Callable[[random.Random, int, int], bool]] = {
+    'frame': frame_update,
+    'page': page_update,
+    'commands': command_storm,
+    'malformed': malformed,
+}
+
+def run(mix: Dict[str, float], rate: float, duration: float, address=0x3C, port=12345, seed=0):
+    for name in mix:
+        if name not in MIXES:
+            raise ValueError(f'Unknown traffic {name}, expected one of {list(MIXES)}')
+    if rate <= 0:
+        raise ValueError(f'Rate {rate} must be positive')
+
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    sent = dict.fromkeys(names, 0)
+    send_errors = 0
+
+    before = read_stats(address, port=port)
+    start = time.perf_counter()
+    count = 0
+    while True:
+        now = time.perf_counter() - start
+        if now >= duration:
+            break
+        delay = count / rate - now
+        if delay > 0:
+            time.sleep(delay)
+        name = rng.choices(names, weights)[0]
+        try:
+            MIXES[name](rng, address, port)
+            sent[name] += 1
+        except OSError:
+            send_errors += 1
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    # Let the emulator drain its socket before asking for counters
+    time.sleep(0.5)
+    after = read_stats(address, port=port)
+
+    report = {
+        'sent': sent,
+        'send_errors': send_errors,
+        'elapsed': elapsed,
+        'target_rate': rate,
+        'achieved_rate': sum(sent.values()) / elapsed if elapsed else 0.0,
+        'emulator': None,
+    }
+    if before is not None and after is not None:
+        delta = {field: after[field] - before[field] for field in after}
+        delta['drops'] = sum(sent.values()) - delta['packets']
+        report['emulator'] = delta
+    return report
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Synthetic SSD1306 traffic for the emulator')
+    parser.add_argument('--mix', default='frame=1,page=8,commands=1,malformed=1',
+                        help=f'Comma separated name=weight pairs from {list(MIXES)}')
+    parser.add_argument('--rate', type=float, default=200.0, help='Target messages per second')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=0x3C)
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mix = {name: float(weight) for name, weight in (pair.split('=') for pair in args.mix.split(','))}
+    report = run(mix, args.rate, args.duration, args.address, args.port, args.seed)
+
+    print(f'Sent:     {sum(report["sent"].values())} ' + ' '.join(f'{k}={v}' for k, v in report['sent'].items()))
+    print(f'Rate:     {report["achieved_rate"]:.1f}/s achieved, {report["target_rate"]:.1f}/s target')
+    print(f'Errors:   {report["send_errors"]} send')
+    emulator = report['emulator']
+    if emulator is None:
+        print('Emulator: no answer to the stats query')
+    else:
+        print(f'Emulator: {emulator["packets"]} received, {emulator["drops"]} dropped, '
+              f'{emulator["errors"]} decode errors, {emulator["desyncs"]} desyncs')
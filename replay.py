@@ -0,0 +1,67 @@
+# replay.py
+import time
+
+import lcd_display
+from capture import CaptureReader
+from lcd_display import LCDDisplay, LCDEmulator
+
+def replay(path, realtime=False, emulator=None, port=12345):
+    if emulator is None:
+        emulator = LCDEmulator(headless=True)
+
+    transactions = 0
+    bytes_ = 0
+    errors = 0
+    first_timestamp = None
+    start = time.perf_counter()
+    for transaction in CaptureReader(path):
+        if realtime:
+            if first_timestamp is None:
+                first_timestamp = transaction.timestamp
+            delay = (transaction.timestamp - first_timestamp) - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if (port, transaction.address) not in emulator.panels:
+            panel = emulator.add_panel(port, transaction.address)
+            if not emulator.headless:
+                panel.draw_initial_display()
+                lcd_display.printable_row = lcd_display.printable_row_save = emulator.height + 1
+        try:
+            emulator.feed(port, bytes([transaction.address << 1 | 0]) + transaction.stream)
+            if not emulator.headless:
+                emulator.render()
+        except Exception as e:
+            errors += 1
+            if not emulator.headless:
+                print(f'Error: {e}')
+        transactions += 1
+        bytes_ += 1 + len(transaction.stream)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'transactions': transactions,
+        'bytes': bytes_,
+        'errors': errors,
+        'elapsed': elapsed,
+        'transactions_per_second': transactions / elapsed if elapsed else 0.0,
+        'bytes_per_second': bytes_ / elapsed if elapsed else 0.0,
+    }
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay an SSD1306 capture through the emulator decoder')
+    parser.add_argument('capture', help='Capture file written by capture.CaptureWriter')
+    parser.add_argument('--realtime', action='store_true', help='Honour capture timestamps instead of running flat out')
+    parser.add_argument('--render', action='store_true', help='Draw the panels on the terminal while decoding')
+    args = parser.parse_args()
+
+    emulator = LCDEmulator(headless=not args.render)
+    if args.render:
+        LCDDisplay.clear_screen()
+    stats = replay(args.capture, args.realtime, emulator)
+
+    print(f'Transactions: {stats["transactions"]} ({stats["errors"]} errors)')
+    print(f'Bytes:        {stats["bytes"]}')
+    print(f'Elapsed:      {stats["elapsed"]:.3f} s')
+    print(f'Throughput:   {stats["transactions_per_second"]:.0f} transactions/s, {stats["bytes_per_second"] / 1024:.1f} KiB/s')
@@ -0,0 +1,144 @@
+# scrolling.py
+from typing import Callable, Dict, List, Union
+
+from drawing import DRAW_COPY, bitmap
+from fonts import FontBase
+from layout import Layout, Printer, Tile, Window
+from ssd1306 import *
+
+class Viewport:
+    """
+    Off-screen canvas wider than its tile - the tile shows `tile.width` columns of it starting at `offset`.
+    Draw into viewport.canvas once, then scrolling only slices the canvas rows into the tile,
+    and the tile's dirty tracking sends just the bytes that changed.
+    The viewport owns pixel rows y..y+height-1 of the tile - other rows on the same pages are left as they are.
+    """
+    def __init__(self, tile: Tile, width: int, y: int = 0, height: Union[None, int] = None, wrap: Union[None, int] = None):
+        if not isinstance(tile, Tile):
+            raise TypeError(f'Expected Tile, got {type(tile)}')
+        height = tile.height * 8 - y if height is None else height
+        if y < 0 or height <= 0 or y + height > tile.height * 8:
+            raise ValueError(f'Pixel rows {y}-{y + height - 1} out of range (0-{tile.height * 8 - 1})')
+        if width < tile.width:
+            raise ValueError(f'Canvas width {width} is narrower than {str(tile).split(chr(0x0a))[0]}')
+        if wrap is not None and not 0 < wrap <= width - tile.width + 1:
+            raise ValueError(f'Wrap period {wrap} out of range (1-{width - tile.width + 1})')
+
+        self.tile = tile
+        self.y, self.height = y, height
+        # Standalone tile, top aligned - anything that draws on a tile draws on the canvas, and nothing is sent
+        self.canvas = Tile(0, 0, (height + 7) // 8 - 1, width - 1)
+        # With a period the offset wraps - the canvas must repeat its first tile.width columns at `wrap`
+        self.wrap = wrap
+        self.offset = 0
+
+    @property
+    def limit(self) -> int:
+        # Largest offset that still fills the tile
+        return self.canvas.width - self.tile.width
+
+    def scroll_to(self, offset: int, callback: Union[None, Callable[[Window, memoryview], bool]] = None):
+        if self.wrap is not None:
+            offset %= self.wrap
+        elif not 0 <= offset <= self.limit:
+            raise ValueError(f'Offset {offset} out of range (0-{self.limit})')
+        self.offset = offset
+        canvas, width = self.canvas, self.tile.width
+        with self.tile.lock:
+            # Page aligned and whole pages is a plain blit, otherwise only the viewport's pixel rows are copied
+            bitmap(self.tile, 0, self.y, [canvas._data[page][offset:offset + width] for page in range(canvas.height)],
+                   DRAW_COPY, pixel_height=self.height)
+        if callback is not None and not self.tile.flush(callback):
+            raise RuntimeError('Failed to flush tile')
+
+    def scroll(self, step: int = 1, callback: Union[None, Callable[[Window, memoryview], bool]] = None):
+        # Without wrapping the viewport stops at either end
+        offset = self.offset + step
+        if self.wrap is None:
+            offset = min(max(offset, 0), self.limit)
+        self.scroll_to(offset, callback)
+
+class Marquee(Viewport):
+    # Text rendered once and scrolled round in a loop, e.g. animator.every(0.05, marquee.scroll)
+    def __init__(self, printer: Printer, tile_index: int, text: str, font: Dict[str, FontBase], y: int = 0,
+                 gap: Union[None, int] = None):
+        tile = printer._validate(tile_index, text, font)
+        rows = printer._render(text, font)
+        height = printer._height(text, font, len(rows))
+        gap = tile.width // 4 if gap is None else gap
+        if gap < 0:
+            raise ValueError(f'Gap {gap} must not be negative')
+
+        # Text, gap, then the head of the text again so every offset is one contiguous slice
+        period = len(rows[0]) + gap
+        super().__init__(tile, period + tile.width - 1, y, height, period)
+        for x in range(0, self.canvas.width, period):
+            bitmap(self.canvas, x, 0, rows, DRAW_COPY, pixel_height=height)
+        self.text = text
+        self.scroll_to(0)
+
+class Ticker:
+    """
+    Hardware horizontal scroll of a full-width tile - its content is sent once, then the controller rotates
+    those pages one column every few frames with no bus traffic at all.
+    Do not draw into the tile while it runs - stop() hands it back and resends it on the next commit.
+    """
+    def __init__(self, layout: Layout, tile_index: int, transport: Callable[[bytes, bytes], bool], speed: float = 30.0,
+                 direction: int = OPTION_HORIZONTAL_SCROLL_LEFT):
+        if not isinstance(layout, Layout):
+            raise TypeError(f'Expected Layout, got {type(layout)}')
+        if tile_index < 0 or tile_index >= len(layout.tiles):
+            raise ValueError(f'Tile index {tile_index} out of range (0-{len(layout.tiles)-1})')
+        tile = layout.tiles[tile_index]
+        if tile.startcolumn != 0 or tile.endcolumn != layout.columns - 1:
+            raise ValueError(f'The controller scrolls whole pages - {str(tile).split(chr(0x0a))[0]} is not full width')
+        if not callable(transport):
+            raise TypeError('Transport must be callable')
+        if direction not in (OPTION_HORIZONTAL_SCROLL_LEFT, OPTION_HORIZONTAL_SCROLL_RIGHT):
+            raise ValueError(f'Invalid scroll direction {direction}')
+        if speed <= 0:
+            raise ValueError(f'Speed {speed} must be positive')
+
+        self.layout = layout
+        self.tile = tile
+        self.transport = transport
+        self.direction = direction
+        # Nearest step interval the controller offers - columns per second = FRAME_RATE / frames
+        self.interval = min(SCROLL_INTERVAL_FRAMES, key=lambda code: abs(FRAME_RATE / SCROLL_INTERVAL_FRAMES[code] - speed))
+        self.running = False
+
+    @property
+    def speed(self) -> float:
+        return FRAME_RATE / SCROLL_INTERVAL_FRAMES[self.interval]
+
+    def start(self) -> bool:
+        # Sends whatever is pending (the ticker content included), then sets up and starts the scroll in one transaction
+        if self.running:
+            self.stop(resend=False)
+        tile = self.tile
+        # Only bytes the shadow does not already match go out
+        tile._mark_dirty(0, 0, tile.height - 1, tile.width - 1)
+        if not self.layout.commit(self.transport):
+            return False
+        commands = SSD1306_SCROLL_DEACTIVATE.get_command()
+        commands += SSD1306_SCROLL_HORIZONTAL.get_command(self.direction, 0x00, tile.startpage, self.interval,
+                                                          tile.endpage, 0x00, 0xFF)
+        commands += SSD1306_SCROLL_ACTIVATE.get_command()
+        with self.layout._lock:
+            if not self.transport(bytes(commands), b''):
+                return False
+            # The scrolled pages no longer match the shadow
+            self.layout.invalidate(tile)
+        self.running = True
+        return True
+
+    def stop(self, resend: bool = True) -> bool:
+        # The controller leaves its RAM rotated by however far it got - the tile goes back as it was drawn
+        if not self.transport(bytes(SSD1306_SCROLL_DEACTIVATE.get_command()), b''):
+            return False
+        self.running = False
+        tile = self.tile
+        tile._mark_dirty(0, 0, tile.height - 1, tile.width - 1)
+        if resend:
+            return self.layout.commit(self.transport)
+        return True
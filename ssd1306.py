@@ -101,6 +101,51 @@ class CommandWithCallable(CommandBase):
         assert data[0] == self.command, f'Expected command {self.command}, got {data[0]}'
         return self.func_inverse(data[1]), data[2:]
 
+# Control byte - Co | D/C# | 000000 - follows the slave address in every write transaction
+SSD1306_CONTROL_CO = 0x80       # Continuation - exactly one byte follows before the next control byte
+SSD1306_CONTROL_DATA = 0x40     # D/C# - following byte(s) are GDDRAM data, otherwise commands
+SSD1306_CONTROL_COMMAND = 0x00
+
+def encode_control_stream(commands=(), data=()) -> bytes:
+    """
+    Packs commands and data into one write transaction (without the slave address).
+    Commands only - `0x00 cmd cmd ...`; with data - `0x80 cmd 0x80 cmd ... 0x40 data ...`.
+    """
+    if not data:
+        return bytes([SSD1306_CONTROL_COMMAND]) + bytes(commands)
+    stream = bytearray()
+    for byte in commands:
+        stream += bytes([SSD1306_CONTROL_CO | SSD1306_CONTROL_COMMAND, byte])
+    stream.append(SSD1306_CONTROL_DATA)
+    stream += data
+    return bytes(stream)
+
+def decode_control_stream(stream):
+    """
+    Splits a write transaction (without the slave address) into (is_data, bytes) segments.
+    Adjacent segments of the same kind are merged.
+    """
+    segments = []
+    i = 0
+    while i < len(stream):
+        control = stream[i]
+        if control & ~(SSD1306_CONTROL_CO | SSD1306_CONTROL_DATA):
+            raise ValueError(f'Invalid control byte 0x{control:02X} at offset {i}')
+        is_data = bool(control & SSD1306_CONTROL_DATA)
+        if control & SSD1306_CONTROL_CO:
+            if i + 1 >= len(stream):
+                raise ValueError(f'Control byte 0x{control:02X} at offset {i} is not followed by a byte')
+            segment = bytes(stream[i + 1:i + 2])
+            i += 2
+        else:
+            segment = bytes(stream[i + 1:])
+            i = len(stream)
+        if segments and segments[-1][0] == is_data:
+            segments[-1] = (is_data, segments[-1][1] + segment)
+        else:
+            segments.append((is_data, segment))
+    return segments
+
 # SSD1306_I2C_ADDRESS = 0x3C    # 011110+SA0+RW - 0x3C or 0x3D
 OPTION_I2C_ADDRESS_WRITE = 0x0
 OPTION_I2C_ADDRESS_READ = 0x1
@@ -140,6 +185,11 @@ SSD1306_SCROLL_HORIZONTAL_VERTICAL = CommandWithBitmaskAndArgs(0x29, 0x1, [
 SSD1306_SCROLL_DEACTIVATE = Command(0x2E)
 SSD1306_SCROLL_ACTIVATE = Command(0x2F)
 
+# Horizontal scroll step interval - 3 bit code -> frames between one-column steps
+SCROLL_INTERVAL_FRAMES = {0b111: 2, 0b100: 3, 0b101: 4, 0b000: 5, 0b110: 25, 0b001: 64, 0b010: 128, 0b011: 256}
+# Approximate frame rate with the usual 128x32 setup (0xD5 0x80, 0xD9 0xF1) - Fosc / ((phase1 + phase2 + 50) * MUX)
+FRAME_RATE = 370_000 / ((1 + 15 + 50) * 32)
+
 SSD1306_SET_VERTICAL_SCROLL_AREA = CommandWithArgs(0xA3, 2, [0x3F, 0x7F])
 
 # Address setting commands
@@ -1,9 +1,10 @@
 import time
 
-from layout import Layout, Printer
+from animation import Animator
+from layout import Layout, Printer, PRIORITY_URGENT
 from fonts import FontBase, font8x9, font6x4, font16x8, print_columns
 from lcd_display import PAGES, COLUMNS
-from lcd_update import set_mode, set_page, set_column, write
+from lcd_update import set_mode, set_page, set_column, write, send_update, send_transaction
 
 N_PAGES, N_COLUMNS = PAGES, COLUMNS
 
@@ -35,57 +36,65 @@ layout2 = None
 layout1 = Layout(N_PAGES, N_COLUMNS)
 layout1.add_tile(0,                     0,                      0,                          32 * 3 - 1)
 layout1.add_tile(1,                     0,                      1,                          32 * 3 - 1)
-layout1.add_tile(0,            32 * 3 + 8,                      0,                       N_COLUMNS - 1)
-layout1.add_tile(1,            32 * 3 + 8,                      1,                       N_COLUMNS - 1)
+layout1.add_tile(0,            32 * 3 + 8,                      0,                       N_COLUMNS - 1,   PRIORITY_URGENT)    # Alarms
+layout1.add_tile(1,            32 * 3 + 8,                      1,                       N_COLUMNS - 1,   PRIORITY_URGENT)
 layout1.add_tile(2,                     0,                      3,                       N_COLUMNS - 1)
 layout1.add_tile(0,                32 * 3,                      0,                          32 * 3 + 7)      # Empty tiles for aesthetics
 layout1.add_tile(1,                32 * 3,                      1,                          32 * 3 + 7)      # Empty tiles for aesthetics
 
 printer = Printer(layout1)
 
-def send_update(tile, bytes_ : bytes) -> bool:
-    # import time; time.sleep(0.001)
-    return set_page(tile.startpage, tile.endpage) \
-        and set_column(tile.startcolumn, tile.endcolumn) \
-        and write(bytes(bytes_))
-
 ret = layout1.clear(send_update)
 print(f'Clear: {ret}')
 
 time.sleep(1)
 
-printer(0, '!', font8x9, send_update)
-printer(0, 'Voltage - R-phase', font8x9, send_update)
-printer(1, 'Unit:- V', font8x9, send_update)
+# One planned transfer for the whole dashboard
+with layout1.batch(send_transaction):
+    printer(0, '!', font8x9, send_update)
+    printer(0, 'Voltage - R-phase', font8x9, send_update)
+    printer(1, 'Unit:- V', font8x9, send_update)
 
-printer(2, 'UV', font8x9, send_update)
-printer(3, 'GF', font8x9, send_update)
+    printer(2, 'UV', font8x9, send_update)
+    printer(3, 'GF', font8x9, send_update)
 
-printer.truncate = False
-printer(4, '230.000000000000', font16x8, send_update)
+    printer.truncate = False
+    printer(4, '230.000000000000', font16x8, send_update)
 
 time.sleep(1)
 
-layout2 = Layout(N_PAGES, N_COLUMNS)
+screen1 = layout1.capture()
+
+# Same panel, same shadow - switching screens sends only what differs
+layout2 = Layout(N_PAGES, N_COLUMNS, share=layout1)
 layout2.add_tile(0,                     0,                      0,                          N_COLUMNS - 5)
 layout2.add_tile(1,                     0,                      1,                          N_COLUMNS - 5)
 layout2.add_tile(2,                     0,                      3,                          N_COLUMNS - 5)
 layout2.add_tile(0,         N_COLUMNS - 4,                      1,                          N_COLUMNS - 1)
 layout2.add_tile(2,         N_COLUMNS - 4,                      3,                          N_COLUMNS - 1)
 
-layout2.clear(send_update)
+# Render off screen - submitted text is drawn into the tiles without sending anything
 printer = Printer(layout2)
-printer(0, 'Voltage - R-phase', font8x9, send_update)
-printer(1, 'Unit:- V', font8x9, send_update)
-printer(2, '230.000000000000', font16x8, send_update)
+printer.submit(0, 'Voltage - R-phase', font8x9)
+printer.submit(1, 'Unit:- V', font8x9)
+printer.submit(2, '230.000000000000', font16x8)
+printer.submit(4, [[0x00] * 2] * 4, None)
+printer.render_pending()
+screen2 = layout2.capture()
+
+layout2.show(screen2, send_transaction)
+time.sleep(1)
 
-printer(4, [[0x00] * 2] * 4, None, send_update)
+# Flip back and forth - each switch is a diff against what the panel shows
+layout1.show(screen1, send_transaction)
+time.sleep(1)
+layout2.show(screen2, send_transaction)
 
-while True:
-    printer(3, [[0xff] * 2] * 4, None, send_update)
-    time.sleep(0.5)
-    printer(3, [[0x00] * 2] * 4, None, send_update)
-    time.sleep(0.5)
+# Blink tile 3 - every effect due on a tick shares one transfer
+animator = Animator(layout2, send_transaction)
+animator.toggle(0.5, lambda: printer(3, [[0xff] * 2] * 4, None, send_update),
+                     lambda: printer(3, [[0x00] * 2] * 4, None, send_update))
+animator.run()
 
 
 from ch347bus import I2CDevice
@@ -117,9 +126,10 @@ for cmd in setup:
     i2c.write_byte_data(0x3C, 0x00, cmd)
 
 def write_func(tile, data):
-    i2c.write_byte_data(0x3C, 0x00, bytes([0x20, 0x00]))
-    i2c.write_byte_data(0x3C, 0x00, bytes([0x22, tile.startpage, tile.endpage]))
-    i2c.write_byte_data(0x3C, 0x00, bytes([0x21, tile.startcolumn, tile.endcolumn]))
+    # Addressing mode, page and column windows share a transaction with the first data chunk
+    commands = [0x20, 0x00, 0x22, tile.startpage, tile.endpage, 0x21, tile.startcolumn, tile.endcolumn]
+    i2c.write_transaction(0x3C, commands, data[:32])
+    data = data[32:]
     while data:
         i2c.write_block_data(0x3C, 0x40, data[:32])
         data = data[32:]
@@ -0,0 +1,153 @@
+# widgets.py
+from collections import deque
+from typing import Callable, Deque, Union
+
+from drawing import DRAW_CLEAR, DRAW_OR, DRAW_XOR, fill, hline, rect, vline
+from layout import Tile, Window
+
+# Widgets draw into a region of a tile and remember what they drew, so an update only touches what changed.
+# They draw under the tile lock and do not send anything unless given a callback - flush the tile or commit the layout as usual.
+
+class Widget:
+    def __init__(self, tile: Tile, x: int = 0, y: int = 0, width: Union[None, int] = None, height: Union[None, int] = None,
+                 minimum: float = 0, maximum: float = 100):
+        if not isinstance(tile, Tile):
+            raise TypeError(f'Expected Tile, got {type(tile)}')
+        width = tile.width - x if width is None else width
+        height = tile.height * 8 - y if height is None else height
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > tile.width or y + height > tile.height * 8:
+            raise ValueError(f'Region {width}x{height} at ({x}, {y}) does not fit {tile}')
+        if minimum >= maximum:
+            raise ValueError(f'Minimum {minimum} must be less than maximum {maximum}')
+
+        self.tile = tile
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.minimum, self.maximum = minimum, maximum
+
+    def _scale(self, value: float, span: int) -> int:
+        # Value to 0..span pixels, clamped to the range
+        value = min(max(value, self.minimum), self.maximum)
+        return round((value - self.minimum) * span / (self.maximum - self.minimum))
+
+    def _flush(self, callback: Union[None, Callable[[Window, memoryview], bool]]):
+        if callback is not None and not self.tile.flush(callback):
+            raise RuntimeError('Failed to flush tile')
+
+class BarGraph(Widget):
+    def __init__(self, tile: Tile, x: int = 0, y: int = 0, width: Union[None, int] = None, height: Union[None, int] = None,
+                 minimum: float = 0, maximum: float = 100, vertical: bool = False, border: bool = False):
+        super().__init__(tile, x, y, width, height, minimum, maximum)
+        self.vertical = vertical
+        self.border = border
+        self._length : Union[None, int] = None     # Filled pixels last drawn, None before the first draw
+
+    def _inner(self):
+        if self.border:
+            return self.x + 1, self.y + 1, self.width - 2, self.height - 2
+        return self.x, self.y, self.width, self.height
+
+    def _span(self, start: int, end: int, mode: int):
+        # Fills bar pixels start..end-1 - left to right, or bottom to top when vertical
+        x, y, width, height = self._inner()
+        if self.vertical:
+            fill(self.tile, x, y + height - end, width, end - start, mode)
+        else:
+            fill(self.tile, x + start, y, end - start, height, mode)
+
+    def redraw(self):
+        fill(self.tile, self.x, self.y, self.width, self.height, DRAW_CLEAR)
+        if self.border:
+            rect(self.tile, self.x, self.y, self.width, self.height)
+        self._length = 0
+
+    def update(self, value: float, callback: Union[None, Callable[[Window, memoryview], bool]] = None):
+        with self.tile.lock:
+            if self._length is None:
+                self.redraw()
+            _, _, width, height = self._inner()
+            length = self._scale(value, height if self.vertical else width)
+            if length > self._length:
+                self._span(self._length, length, DRAW_OR)
+            elif length < self._length:
+                self._span(length, self._length, DRAW_CLEAR)
+            self._length = length
+        self._flush(callback)
+
+class Sparkline(Widget):
+    # Page-aligned so the history can scroll by moving whole bytes
+    def __init__(self, tile: Tile, column: int = 0, width: Union[None, int] = None, page: int = 0, pages: Union[None, int] = None,
+                 minimum: float = 0, maximum: float = 100):
+        pages = tile.height - page if pages is None else pages
+        super().__init__(tile, column, page * 8, width, pages * 8, minimum, maximum)
+        self.page, self.pages = page, pages
+        # Pixel rows from the top, newest last - one more than fits so the leftmost column keeps its joining segment
+        self.history : Deque[int] = deque(maxlen=self.width + 1)
+        self._drawn = False
+
+    def _row(self, value: float) -> int:
+        return self.y + self.height - 1 - self._scale(value, self.height - 1)
+
+    def _column(self, x: int, row: int, previous: Union[None, int]):
+        # One sample - a vertical segment joining it to the previous one keeps the line continuous
+        top, bottom = (row, row) if previous is None else (min(row, previous), max(row, previous))
+        vline(self.tile, x, top, bottom - top + 1)
+
+    def redraw(self):
+        fill(self.tile, self.x, self.y, self.width, self.height, DRAW_CLEAR)
+        samples = list(self.history)
+        previous = samples.pop(0) if len(samples) > self.width else None
+        start = self.x + self.width - len(samples)
+        for i, row in enumerate(samples):
+            self._column(start + i, row, previous)
+            previous = row
+        self._drawn = True
+
+    def push(self, value: float, callback: Union[None, Callable[[Window, memoryview], bool]] = None):
+        with self.tile.lock:
+            previous = self.history[-1] if self.history else None
+            self.history.append(self._row(value))
+            if not self._drawn:
+                self.redraw()
+            else:
+                # Rotate the region one column left with one slice per page, then draw only the new column
+                tile, x, last = self.tile, self.x, self.x + self.width - 1
+                if self.width > 1:
+                    tile.blit(self.page, x, [bytes(tile._data[page][x + 1:last + 1])
+                                             for page in range(self.page, self.page + self.pages)])
+                fill(tile, last, self.y, 1, self.height, DRAW_CLEAR)
+                self._column(last, self.history[-1], previous)
+        self._flush(callback)
+
+class Gauge(Widget):
+    # Linear gauge - a scale with tick marks along the bottom and a needle that moves along it
+    def __init__(self, tile: Tile, x: int = 0, y: int = 0, width: Union[None, int] = None, height: Union[None, int] = None,
+                 minimum: float = 0, maximum: float = 100, ticks: int = 5):
+        super().__init__(tile, x, y, width, height, minimum, maximum)
+        if self.height < 3:
+            raise ValueError(f'Gauge height {self.height} must be at least 3')
+        if ticks < 0:
+            raise ValueError(f'Ticks {ticks} must not be negative')
+        self.ticks = ticks
+        self._needle : Union[None, int] = None     # Needle column last drawn
+
+    def redraw(self):
+        fill(self.tile, self.x, self.y, self.width, self.height, DRAW_CLEAR)
+        bottom = self.y + self.height - 1
+        hline(self.tile, self.x, bottom, self.width)
+        for i in range(self.ticks):
+            tick = self.x + (round(i * (self.width - 1) / (self.ticks - 1)) if self.ticks > 1 else (self.width - 1) // 2)
+            vline(self.tile, tick, bottom - 1, 1)
+        self._needle = None
+
+    def update(self, value: float, callback: Union[None, Callable[[Window, memoryview], bool]] = None):
+        with self.tile.lock:
+            if self._needle is None:
+                self.redraw()
+            needle = self.x + self._scale(value, self.width - 1)
+            if needle != self._needle:
+                # XOR takes the old needle off without disturbing the scale under it
+                if self._needle is not None:
+                    vline(self.tile, self._needle, self.y, self.height - 2, DRAW_XOR)
+                vline(self.tile, needle, self.y, self.height - 2, DRAW_XOR)
+                self._needle = needle
+        self._flush(callback)